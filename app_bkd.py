@@ -93,8 +93,13 @@ st.markdown("""
 # Initialize GEE
 gee_status = initialize_gee()
 
-# Initialize AI Engine
-ai_validator = AIValidator()
+# Initialize AI Engine once per process: weights are loaded and warmed up
+# before the first request instead of on every rerun
+@st.cache_resource(show_spinner="Memuat model AI...")
+def get_ai_validator():
+    return AIValidator(use_gpu=True)
+
+ai_validator = get_ai_validator()
 ai_status_msg = get_ai_status()
 
 
@@ -1313,7 +1318,13 @@ with tab6:
     # Initialize street mapper
     try:
         from config.bkd_config import BOUNDARY_GEOJSON_PATH
-        street_mapper = StreetMapper(BOUNDARY_GEOJSON_PATH)
+        
+        # Keep one mapper across reruns so its per-Kecamatan street cache survives
+        @st.cache_resource(show_spinner=False)
+        def get_street_mapper(geojson_path):
+            return StreetMapper(geojson_path)
+        
+        street_mapper = get_street_mapper(BOUNDARY_GEOJSON_PATH)
         
         # Kecamatan selection
         kecamatan_list = street_mapper.get_kecamatan_list()
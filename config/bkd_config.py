@@ -142,6 +142,8 @@ MATARAM_DISTRICTS = {
 PARKING_MIN_AREA = 50         # m² - minimum area (Indomaret/Retail scale)
 PARKING_MAX_AREA = 10000      # m² - maximum area (filter outliers)
 PARKING_ASPECT_RATIO = 0.15    # Min aspect ratio (Allow narrow retail parking)
+# Max perimeter²/area, equal to a rectangle at PARKING_ASPECT_RATIO (~35; square = 16)
+PARKING_MAX_COMPACTNESS = 4 * (1 + PARKING_ASPECT_RATIO) ** 2 / PARKING_ASPECT_RATIO
 PARKING_ACTIVITY_MIN = 100    # Threshold untuk deteksi pergerakan kendaraan
 ROAD_BUFFER_M = 25            # Jarak maksimum dari jalan raya (meter)
 
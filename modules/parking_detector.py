@@ -4,18 +4,135 @@ Menggunakan spectral analysis dan texture filtering
 """
 
 import ee
+import math
+import string
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import sys
 import os
+
+# Numba is optional: without it the kernel below runs as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config.bkd_config import (
     PARKING_TARIFF, PARKING_UTILIZATION, PARKING_HOURS,
-    PARKING_MIN_AREA, PARKING_MAX_AREA, PARKING_ASPECT_RATIO
+    PARKING_MIN_AREA, PARKING_MAX_AREA, PARKING_MAX_COMPACTNESS
 )
 from modules.osm_bridge import OSMBridge
 
 
+@njit(cache=True, fastmath=True)
+def _polygon_metrics(coords):
+    """Shoelace area (m²) and centroid (lat, lon) of a closed lon/lat ring"""
+    n = coords.shape[0]
+    s = 0.0
+    lat_sum = 0.0
+    lon_sum = 0.0
+    for i in range(n - 1):
+        s += coords[i, 0] * coords[i + 1, 1] - coords[i + 1, 0] * coords[i, 1]
+        lat_sum += coords[i, 1]
+        lon_sum += coords[i, 0]
+    lat_avg = lat_sum / (n - 1)
+    # Convert to meters approx (1 deg ~ 111320m at equator)
+    m_per_deg_lat = 111320.0
+    m_per_deg_lon = 111320.0 * math.cos(math.radians(lat_avg))
+    return 0.5 * abs(s) * m_per_deg_lat * m_per_deg_lon, lat_avg, lon_sum / (n - 1)
+
+
+# Warm up once at import so the first detection does not pay the compile cost
+_polygon_metrics(np.zeros((4, 2), dtype=np.float64))
+
+def _enable_fast_json():
+    """
+    Parse GEE API responses (getInfo) with orjson when it is installed.
+    earthengine-api decodes responses through googleapiclient's JsonModel;
+    only its module-level `json` reference is swapped, stdlib json is untouched.
+    """
+    try:
+        import json
+        import orjson
+        from googleapiclient import model as _gapi_model
+    except ImportError:
+        return
+    
+    class _FastJSON:
+        def __getattr__(self, name):
+            return getattr(json, name)
+        
+        @staticmethod
+        def loads(s, *args, **kwargs):
+            if not args and not kwargs:
+                try:
+                    return orjson.loads(s)
+                except orjson.JSONDecodeError:
+                    pass  # Let stdlib json decide (NaN literals, non-JSON bodies)
+            return json.loads(s, *args, **kwargs)
+    
+    _gapi_model.json = _FastJSON()
+
+
+_enable_fast_json()
+
+# In-process cache of GEE composites keyed by (serialized ROI, year).
+# Module level so it survives Streamlit reruns, which recreate the detector;
+# lru_cache is safe to share between Streamlit session threads.
+@lru_cache(maxsize=16)
+def _composites(roi_json: str, year: int) -> Tuple[ee.Image, ee.Image, ee.Image]:
+    """(S2 median, Dynamic World median, activity) for a serialized ROI and year"""
+    roi = ee.Geometry(ee.deserializer.fromJSON(roi_json))
+    
+    s2_col = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
+        .filterBounds(roi) \
+        .filterDate(f'{year}-01-01', f'{year}-12-31') \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 30)) # Relaxed for Indo climate
+    s2_median = s2_col.median().clip(roi)
+    
+    dw_col = ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1") \
+        .filterBounds(roi) \
+        .filterDate(f'{year}-01-01', f'{year}-12-31')
+    dw = dw_col.median().clip(roi)
+    
+    # Corrected GEE stdDev calculation for ImageCollection
+    activity_val = s2_col.select(['B2', 'B3', 'B4']).reduce(ee.Reducer.stdDev()).reduce(ee.Reducer.mean()).clip(roi)
+    
+    return s2_median, dw, activity_val
+
+
+class ParkingRecord(NamedTuple):
+    """
+    One detected parking area. Kept as a compact tuple while detecting;
+    converted to a dict only in the returned result (see to_dict).
+    """
+    id: str
+    lat: float
+    lon: float
+    area_m2: float
+    parking_type: str
+    estimated_capacity: Dict
+    revenue_daily: int
+    revenue_monthly: int
+    revenue_annual: int
+    coordinates: List
+    # OSM-only fields (omitted from the dict when not set)
+    name: Optional[str] = None
+    category: Optional[str] = None
+    source: Optional[str] = None
+    activity_score: Optional[float] = None
+    activity_std: Optional[float] = None
+    brightness: Optional[float] = None
+    confidence: Optional[float] = None
+    
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in zip(self._fields, self) if v is not None}
+
+
 class ParkingDetector:
     """
     Deteksi area parkir menggunakan metode Hybrid:
@@ -24,11 +141,82 @@ class ParkingDetector:
     3. POI-Assisted Detection (OpenStreetMap)
     """
     
+    # Popup skeleton compiled once; only the per-area fields are substituted
+    _POPUP_TPL = string.Template("""
+        <div style='width: 300px; font-family: Arial, sans-serif;'>
+            <h3 style='margin: 0 0 10px 0; color: #1f2937; border-bottom: 2px solid #FFD700; padding-bottom: 5px;'>
+                🅿️ $id - $name
+                $source_badge
+            </h3>
+            
+            $act_label
+            
+            <table style='width: 100%; font-size: 13px;'>
+                $category_row
+                <tr style='background: #f3f4f6;'>
+                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Area</td>
+                    <td style='padding: 8px;'>$area m²</td>
+                </tr>
+                <tr>
+                    <td style='padding: 8px; font-weight: bold;'>🏍️ Kapasitas Motor</td>
+                    <td style='padding: 8px;'>$motor slot</td>
+                </tr>
+                <tr style='background: #f3f4f6;'>
+                    <td style='padding: 8px; font-weight: bold;'>🚗 Kapasitas Mobil</td>
+                    <td style='padding: 8px;'>$mobil slot</td>
+                </tr>
+                <tr>
+                    <td style='padding: 8px; font-weight: bold;'>📊 Total Kapasitas</td>
+                    <td style='padding: 8px; font-weight: bold; color: #f59e0b;'>$total kendaraan</td>
+                </tr>
+            </table>
+            
+            <div style='margin-top: 15px; padding: 10px; background: #fef3c7; border-radius: 5px; border-left: 4px solid #f59e0b;'>
+                <div style='font-weight: bold; color: #92400e; margin-bottom: 5px;'>💰 Estimasi Potensi PAD:</div>
+                <div style='font-size: 12px; color: #1f2937;'>
+                    Per Hari: Rp $rev_daily<br>
+                    Per Bulan: Rp $rev_monthly<br>
+                    <div style='margin-top: 5px; padding-top: 5px; border-top: 1px solid #fcd34d;'>
+                        <b style='color: #92400e; font-size: 14px;'>Per Tahun: Rp $rev_annual</b>
+                    </div>
+                </div>
+            </div>
+            
+            <div style='margin-top: 10px; font-size: 11px; color: #6b7280;'>
+                📍 Koordinat: $lat_fmt, $lon_fmt
+                <br>
+                <a href='https://earth.google.com/web/search/$lat,$lon' target='_blank' style='color: #2563eb; text-decoration: none; font-weight: bold;'>
+                    🌍 Buka di Google Earth
+                </a>
+                <div style='margin-top: 5px; font-style: italic; color: #1e40af;'>
+                    💡 Tips: Gunakan fitur 'Historical Imagery' (ikon jam) di Google Earth untuk melihat bukti tahun $year.
+                </div>
+
+                <!-- AI VALIDATION STATUS -->
+                <div style='margin-top: 10px; padding-top: 5px; border-top: 1px dashed #ccc;'>
+                    $ai_status
+                </div>
+            </div>
+        </div>
+        """)
+    
+    _SOURCE_BADGE_OSM = "<span style='background:#10b981;color:white;padding:2px 6px;border-radius:4px;font-size:10px;margin-left:5px;'>Verified via OSM</span>"
+    _CATEGORY_ROW_TPL = string.Template("<tr><td style='padding:8px;font-weight:bold;'>🏷️ Kategori</td><td style='padding:8px;'>$category</td></tr>")
+    _ACT_LABEL_HIGH = "<div style='color:#10b981; font-weight:bold; font-size:11px;'>🔥 Aktivitas Kendaraan: SANGAT TINGGI</div>"
+    _ACT_LABEL_MID = "<div style='color:#f59e0b; font-weight:bold; font-size:11px;'>🚗 Aktivitas Kendaraan: AKTIF</div>"
+    _ACT_LABEL_NONE = ""
+    
     def __init__(self):
         self.min_area = PARKING_MIN_AREA
         self.max_area = PARKING_MAX_AREA
         self.osm = OSMBridge()
         
+        # Daily revenue per slot (tariff x utilization x hours), per parking type
+        self._rev_coeff = {
+            t: self._revenue_coefficients(t)
+            for t in ('umum', 'perkantoran', 'pasar', 'mall')
+        }
+        
     def detect_parking_areas(self, roi: ee.Geometry, year: int = 2024) -> Dict:
         """
         Deteksi area parkir dalam ROI menggunakan metode Hybrid:
@@ -37,130 +225,163 @@ class ParkingDetector:
         """
         try:
             # 1. Load Satellite Engine (Primary & Historical)
-            s2_col = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-                .filterBounds(roi) \
-                .filterDate(f'{year}-01-01', f'{year}-12-31') \
-                .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 30)) # Relaxed for Indo climate
-            
-            s2_median = s2_col.median().clip(roi)
+            s2_median, dw, activity_val = self._get_composites(roi, year)
             
             # --- PHASE A: STABLE SPECTRAL DETECTION ---
-            ndbi = s2_median.normalizedDifference(['B11', 'B8'])
-            dw_col = ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1") \
-                .filterBounds(roi) \
-                .filterDate(f'{year}-01-01', f'{year}-12-31')
-            dw = dw_col.median().clip(roi)
+            ndbi = self._calculate_ndbi(s2_median)
             built_prob = dw.select('built')
             
-            # Identify impervious surfaces
-            impervious = built_prob.gt(0.12).Or(ndbi.gt(0.01))
-            
             # Exclude buildings
             buildings = ee.FeatureCollection("GOOGLE/Research/open-buildings/v3/polygons").filterBounds(roi)
-            building_mask = ee.Image().byte().paint(buildings, 1)
+            building_mask = ee.Image().byte().paint(buildings, 1).unmask(0)
             
             # PRIMARY MASK
-            parking_mask = impervious.And(building_mask.Not()).selfMask()
+            # Impervious surfaces minus buildings, evaluated as a single per-pixel expression
+            stack = built_prob.rename('built') \
+                .addBands(ndbi) \
+                .addBands(building_mask.rename('building'))
+            parking_mask = stack.expression(
+                "((b('built') > 0.12) || (b('NDBI') > 0.01)) && (b('building') == 0)"
+            ).selfMask()
             
             # Vectorize visual detections
-            visual_vectors = ee.FeatureCollection([])
+            # On failure the spectral phase is skipped; POI results are still returned
+            visual_vectors = None
             try:
+                # tileScale=4 splits tiles so large districts don't run out of memory
                 raw_vectors = parking_mask.reduceToVectors(
-                    geometry=roi, scale=10, geometryType='polygon', maxPixels=1e9
+                    geometry=roi, scale=10, geometryType='polygon', maxPixels=1e9,
+                    bestEffort=True, tileScale=4, eightConnected=False
                 )
-                # CRITICAL: Calculate area and filter by shape
-                visual_vectors = self._filter_by_size_shape(raw_vectors)
-            except: pass
+            except Exception as e:
+                print(f"Vectorization error ({type(e).__name__}): {e}")
+                raw_vectors = None
+            
+            if raw_vectors is not None:
+                try:
+                    # CRITICAL: Calculate area and filter by shape
+                    # Only the final 100 features with area and centroid are materialized;
+                    # geometry is kept (simplified) because the map draws the polygons
+                    visual_vectors = self._filter_by_size_shape(raw_vectors) \
+                        .limit(100) \
+                        .map(self._add_centroid) \
+                        .select(['area', 'cx', 'cy'])
+                except Exception as e:
+                    print(f"Shape filter error ({type(e).__name__}): {e}")
             
             # --- PHASE B: ACTIVITY SCORING (Confidence) ---
-            # Corrected GEE stdDev calculation for ImageCollection
-            activity_val = s2_col.select(['B2', 'B3', 'B4']).reduce(ee.Reducer.stdDev()).reduce(ee.Reducer.mean()).clip(roi)
+            # activity_val (S2 temporal stdDev) is built with the cached composites
             
             # --- PHASE C: POI-ASSISTED DETECTION (The "Indomaret" Bridge) ---
             # Optimized: Use vectorized reduceRegions to avoid N+1 .getInfo() calls
             osm_pois = self.osm.fetch_parking_related_pois(roi)
             poi_parking_data = []
+            fc_with_stats = None
             
             if osm_pois:
                 # 1. Create FeatureCollection from POIs
-                poi_features = []
-                for i, poi in enumerate(osm_pois):
-                    f = ee.Feature(
-                        ee.Geometry.Point([poi['lon'], poi['lat']]),
+                # Only one list of primitives is sent; features are built server-side
+                # Rows without coordinates are dropped here, before they reach the reducer
+                poi_records = [
+                    [poi['lon'], poi['lat'], poi['name'], poi.get('category', 'Komersial')]
+                    for poi in osm_pois
+                    if poi.get('lat') is not None and poi.get('lon') is not None
+                ]
+                
+                # buffer(20) is applied to each point
+                def make_poi_feature(record):
+                    r = ee.List(record)
+                    return ee.Feature(
+                        ee.Geometry.Point([r.get(0), r.get(1)]).buffer(20),
                         {
-                            'name': poi['name'],
-                            'category': poi.get('category', 'Komersial'),
-                            'orig_lat': poi['lat'],
-                            'orig_lon': poi['lon']
+                            'name': r.get(2),
+                            'category': r.get(3),
+                            'orig_lat': r.get(1),
+                            'orig_lon': r.get(0)
                         }
                     )
-                    poi_features.append(f)
                 
-                fc_pois = ee.FeatureCollection(poi_features)
+                # filterBounds prunes POIs of the wider OSM bbox that fall outside the ROI
+                fc_buffered = ee.FeatureCollection(ee.List(poi_records).map(make_poi_feature)) \
+                    .filterBounds(roi)
                 
                 # 2. Batch Reduce (Single Request)
-                # Calculate mean activity score for all POIs at once
-                # buffer(20) is applied to each point
-                def buffer_poi(f):
-                    return f.buffer(20)
-                
-                fc_buffered = fc_pois.map(buffer_poi)
-                
-                # reduceRegions
-                fc_with_stats = activity_val.reduceRegions(
+                # Mean + stdDev of activity and brightness (B4) for all POIs at once;
+                # the combined reducer scans each pixel only once
+                combined = ee.Reducer.mean().combine(ee.Reducer.stdDev(), sharedInputs=True)
+                stats_image = activity_val.rename('activity').addBands(s2_median.select('B4'))
+                # 20 m scale is enough for 20 m POI buffers (4x fewer pixels)
+                fc_with_stats = stats_image.reduceRegions(
                     collection=fc_buffered, 
-                    reducer=ee.Reducer.mean(), 
-                    scale=10
+                    reducer=combined, 
+                    scale=20,
+                    tileScale=4
                 )
-                
-                # 3. Fetch Results (Single .getInfo call)
+            
+            # 3. Fetch Results (POI stats and spectral detections are independent,
+            # so both round trips run concurrently)
+            def fetch_poi_stats():
+                try:
+                    return fc_with_stats.getInfo()['features']
+                except Exception as e:
+                    print(f"Batch OSM reduce error ({type(e).__name__}): {e}")
+                    return []
+            
+            def fetch_visual_vectors():
                 try:
-                    results = fc_with_stats.getInfo()['features']
+                    return visual_vectors.getInfo().get('features', [])
                 except Exception as e:
-                    print(f"Batch OSM reduce error: {e}")
-                    results = []
+                    print(f"Spectral fetch error ({type(e).__name__}): {e}")
+                    return []
+            
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                fut_poi = executor.submit(fetch_poi_stats) if fc_with_stats is not None else None
+                fut_vis = executor.submit(fetch_visual_vectors) if visual_vectors is not None else None
+                results = fut_poi.result() if fut_poi is not None else []
+                features = fut_vis.result() if fut_vis is not None else []
+            
+            # 4. Process Results
+            for i, res in enumerate(results):
+                props = res['properties']
+                # Combined reducer outputs are named <band>_mean / <band>_stdDev
+                act_val = props.get('activity_mean', 0)
+                if act_val is None: act_val = 0
+                
+                lat = props.get('orig_lat')
+                lon = props.get('orig_lon')
+                name = props.get('name')
+                category = props.get('category')
+                
+                # Same logic as before
+                delta = 0.0001
+                square_coords = [[lon-delta, lat-delta], [lon+delta, lat-delta], [lon+delta, lat+delta], [lon-delta, lat+delta], [lon-delta, lat-delta]]
                 
-                # 4. Process Results
-                for i, res in enumerate(results):
-                    props = res['properties']
-                    # 'mean' is the default name from reducer
-                    act_val = props.get('mean', 0)
-                    if act_val is None: act_val = 0
-                    
-                    lat = props.get('orig_lat')
-                    lon = props.get('orig_lon')
-                    name = props.get('name')
-                    category = props.get('category')
-                    
-                    # Same logic as before
-                    delta = 0.0001
-                    square_coords = [[lon-delta, lat-delta], [lon+delta, lat-delta], [lon+delta, lat+delta], [lon-delta, lat+delta], [lon-delta, lat-delta]]
-                    
-                    area_val = 65 
-                    rev_est = self._estimate_parking_revenue(area_val, 'perkantoran')
-                    
-                    poi_parking_data.append({
-                        'id': f"OSM-{i+1:03d}",
-                        'name': name,
-                        'lat': lat, 'lon': lon,
-                        'area_m2': area_val,
-                        'parking_type': 'perkantoran',
-                        'estimated_capacity': self._estimate_capacity(area_val, 'perkantoran'),
-                        'revenue_daily': rev_est['daily'],
-                        'revenue_monthly': rev_est['monthly'],
-                        'revenue_annual': rev_est['annual'],
-                        'coordinates': square_coords,
-                        'category': category,
-                        'source': 'OpenStreetMap',
-                        'activity_score': act_val,
-                        'confidence': 0.95 if (act_val and act_val > 40) else 0.85
-                    })
+                area_val = 65 
+                capacity = self._estimate_capacity(area_val, 'perkantoran')
+                rev_est = self._estimate_parking_revenue(area_val, 'perkantoran', capacity)
+                
+                poi_parking_data.append(ParkingRecord(
+                    id=f"OSM-{i+1:03d}",
+                    name=name,
+                    lat=lat, lon=lon,
+                    area_m2=area_val,
+                    parking_type='perkantoran',
+                    estimated_capacity=capacity,
+                    revenue_daily=rev_est['daily'],
+                    revenue_monthly=rev_est['monthly'],
+                    revenue_annual=rev_est['annual'],
+                    coordinates=square_coords,
+                    category=category,
+                    source='OpenStreetMap',
+                    activity_score=act_val,
+                    activity_std=props.get('activity_stdDev'),
+                    brightness=props.get('B4_mean'),
+                    confidence=0.95 if (act_val and act_val > 40) else 0.85
+                ))
 
             # --- PHASE D: MERGE & PROCESS ---
             spectral_parking_data = []
             try:
-                # Get detections from GEE
-                features = visual_vectors.limit(100).getInfo().get('features', [])
                 spectral_parking_data = self._process_parking_features(features)
             except Exception as e:
                 print(f"Spectral merge error: {e}")
@@ -172,12 +393,13 @@ class ParkingDetector:
             print(f" - Satellite Spectral: {len(spectral_parking_data)}")
             print(f" - Total: {len(all_parking)}")
             
+            parking_areas, total_area, total_revenue = self._summarize_records(all_parking)
             return {
                 'success': True,
                 'count': len(all_parking),
-                'parking_areas': all_parking,
-                'total_area_m2': sum(p['area_m2'] for p in all_parking),
-                'estimated_revenue_annual': sum(p['revenue_annual'] for p in all_parking),
+                'parking_areas': parking_areas,
+                'total_area_m2': total_area,
+                'estimated_revenue_annual': total_revenue,
                 'method': 'V14 Resurrected (Hybrid OSM+Satelit)'
             }
         
@@ -187,15 +409,13 @@ class ParkingDetector:
             traceback.print_exc()
             return {'success': False, 'error': str(e), 'parking_areas': []}
     
-    def _load_sentinel2(self, roi: ee.Geometry, year: int) -> ee.Image:
-        """Load and composite Sentinel-2 imagery"""
-        s2 = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-            .filterBounds(roi) \
-            .filterDate(f'{year}-01-01', f'{year}-12-31') \
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)) \
-            .median() \
-            .clip(roi)
-        return s2
+    def _get_composites(self, roi: ee.Geometry, year: int) -> Tuple[ee.Image, ee.Image, ee.Image]:
+        """
+        Get (S2 median, Dynamic World median, activity) for ROI and year.
+        Repeat queries for the same district reuse the built images.
+        """
+        # serialize() is client-side, so the key costs no GEE round trip
+        return _composites(roi.serialize(), year)
     
     def _calculate_ndbi(self, image: ee.Image) -> ee.Image:
         """Calculate Normalized Difference Built-up Index"""
@@ -203,47 +423,36 @@ class ParkingDetector:
         # Sentinel-2: SWIR=B11, NIR=B8
         return image.normalizedDifference(['B11', 'B8']).rename('NDBI')
     
-    def _calculate_ndvi(self, image: ee.Image) -> ee.Image:
-        """Calculate Normalized Difference Vegetation Index"""
-        # NDVI = (NIR - Red) / (NIR + Red)
-        # Sentinel-2: NIR=B8, Red=B4
-        return image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-    
     def _filter_by_size_shape(self, features: ee.FeatureCollection) -> ee.FeatureCollection:
         """Filter parking areas by size and shape (Road Masking)"""
-        def filter_func(feature):
-            geom = feature.geometry()
-            area = geom.area()
-            
-            # ROAD MASKING LOGIC: Aspect Ratio Analysis
-            # Get oriented bounding box
-            bounds = geom.bounds()
-            coords = ee.List(bounds.coordinates().get(0))
-            
-            p1 = ee.List(coords.get(0))
-            p2 = ee.List(coords.get(1))
-            p3 = ee.List(coords.get(2))
-            
-            # Calculate width and height of bounding box
-            d1 = ee.Number(p1.get(0)).subtract(p2.get(0)).pow(2).add(ee.Number(p1.get(1)).subtract(p2.get(1)).pow(2)).sqrt()
-            d2 = ee.Number(p2.get(0)).subtract(p3.get(0)).pow(2).add(ee.Number(p2.get(1)).subtract(p3.get(1)).pow(2)).sqrt()
-            
-            # Aspect ratio: min(d1, d2) / max(d1, d2)
-            # Road has very low aspect ratio (long and thin)
-            max_d = ee.Number(d1).max(d2)
-            min_d = ee.Number(d1).min(d2)
-            ratio = min_d.divide(max_d)
-            
-            # Filters
-            size_ok = area.gte(self.min_area).And(area.lte(self.max_area))
-            shape_ok = ratio.gt(PARKING_ASPECT_RATIO) # Ignore very thin polygons
-            
-            return feature.set('area', area).set('valid', size_ok.And(shape_ok))
+        def add_area(feature):
+            return feature.set('area', feature.geometry().area(1))
         
-        filtered = features.map(filter_func)
-        return filtered.filter(ee.Filter.eq('valid', True))
+        def add_compactness(feature):
+            # ROAD MASKING LOGIC: Compactness (perimeter² / area)
+            # Road has very high compactness value (long and thin)
+            perimeter = feature.geometry().perimeter(1)
+            return feature.set('perim2_over_area', perimeter.pow(2).divide(feature.get('area')))
+        
+        # Size filter first: most raw vectors are small speckles, so the
+        # perimeter is only computed for polygons that pass it
+        return features.map(add_area) \
+            .filter(ee.Filter.And(
+                ee.Filter.gte('area', self.min_area),
+                ee.Filter.lte('area', self.max_area)
+            )) \
+            .map(add_compactness) \
+            .filter(ee.Filter.lt('perim2_over_area', PARKING_MAX_COMPACTNESS))
+    
+    def _add_centroid(self, feature: ee.Feature) -> ee.Feature:
+        """Set centroid (cx, cy) server-side and simplify the 10 m pixel outline"""
+        geom = feature.geometry()
+        centroid = geom.centroid(1).coordinates()
+        return feature \
+            .setGeometry(geom.simplify(5)) \
+            .set({'cx': centroid.get(0), 'cy': centroid.get(1)})
     
-    def _process_parking_features(self, features: List[Dict]) -> List[Dict]:
+    def _process_parking_features(self, features: List[Dict]) -> List[ParkingRecord]:
         """Process parking features and estimate revenue"""
         parking_data = []
         
@@ -254,19 +463,18 @@ class ParkingDetector:
             # Calculate area (Try props first, then local calculation)
             area_m2 = props.get('area', 0)
             
-            if area_m2 == 0 and geom['type'] == 'Polygon':
+            # Centroid is computed server-side (cx/cy)
+            avg_lat, avg_lon = props.get('cy'), props.get('cx')
+            
+            coords = geom['coordinates'][0] if geom['type'] == 'Polygon' else []
+            if coords and (area_m2 == 0 or avg_lat is None):
                 # Emergency local calculation (approximate)
-                coords = geom['coordinates'][0]
-                # Shoelace formula for area
-                x = [c[0] for c in coords]
-                y = [c[1] for c in coords]
-                # Convert to meters approx (1 deg ~ 111320m at equator)
-                lat_avg = sum(y) / len(y)
-                m_per_deg_lat = 111320
-                m_per_deg_lon = 111320 * np.cos(np.radians(lat_avg))
-                
-                area = 0.5 * abs(sum(x[i] * y[i+1] - x[i+1] * y[i] for i in range(len(x)-1)))
-                area_m2 = area * m_per_deg_lat * m_per_deg_lon
+                ring_area, ring_lat, ring_lon = _polygon_metrics(np.asarray(coords, dtype=np.float64))
+                area_m2 = area_m2 or ring_area
+                if avg_lat is None:
+                    avg_lat, avg_lon = ring_lat, ring_lon
+            elif avg_lat is None:
+                avg_lat, avg_lon = 0, 0
             
             if area_m2 < self.min_area or area_m2 > self.max_area:
                 continue
@@ -274,32 +482,35 @@ class ParkingDetector:
             # Estimate parking type (dummy - based on size)
             parking_type = self._classify_parking_type(area_m2)
             
-            # Calculate centroid
-            if geom['type'] == 'Polygon':
-                coords = geom['coordinates'][0]
-                avg_lat = sum(c[1] for c in coords) / len(coords)
-                avg_lon = sum(c[0] for c in coords) / len(coords)
-            else:
-                avg_lat, avg_lon = 0, 0
-            
             # Estimate revenue
-            revenue = self._estimate_parking_revenue(area_m2, parking_type)
-            
-            parking_data.append({
-                'id': f'PKR-{idx+1:03d}',
-                'lat': avg_lat,
-                'lon': avg_lon,
-                'area_m2': round(area_m2, 1),
-                'parking_type': parking_type,
-                'estimated_capacity': self._estimate_capacity(area_m2, parking_type),
-                'revenue_daily': revenue['daily'],
-                'revenue_monthly': revenue['monthly'],
-                'revenue_annual': revenue['annual'],
-                'coordinates': coords if geom['type'] == 'Polygon' else []
-            })
+            capacity = self._estimate_capacity(area_m2, parking_type)
+            revenue = self._estimate_parking_revenue(area_m2, parking_type, capacity)
+            
+            parking_data.append(ParkingRecord(
+                id=f'PKR-{idx+1:03d}',
+                lat=float(avg_lat),
+                lon=float(avg_lon),
+                area_m2=round(area_m2, 1),
+                parking_type=parking_type,
+                estimated_capacity=capacity,
+                revenue_daily=revenue['daily'],
+                revenue_monthly=revenue['monthly'],
+                revenue_annual=revenue['annual'],
+                coordinates=coords
+            ))
         
         return parking_data
     
+    def _summarize_records(self, records: List[ParkingRecord]) -> Tuple[List[Dict], float, int]:
+        """Convert records to dicts and tally total area and annual revenue in one pass"""
+        parking_areas = []
+        total_area, total_revenue = 0.0, 0
+        for record in records:
+            parking_areas.append(record.to_dict())
+            total_area += record.area_m2
+            total_revenue += record.revenue_annual
+        return parking_areas, total_area, total_revenue
+    
     def _classify_parking_type(self, area_m2: float) -> str:
         """Classify parking type based on area (dummy logic)"""
         if area_m2 < 200:
@@ -330,17 +541,26 @@ class ParkingDetector:
             'total': motor_slots + mobil_slots
         }
     
-    def _estimate_parking_revenue(self, area_m2: float, parking_type: str) -> Dict:
-        """Estimate parking revenue"""
-        capacity = self._estimate_capacity(area_m2, parking_type)
+    def _revenue_coefficients(self, parking_type: str) -> Dict:
+        """Daily revenue per motor/mobil slot for a parking type"""
         utilization = PARKING_UTILIZATION.get(parking_type, 0.5)
         hours_per_day = PARKING_HOURS.get(parking_type, 10)
         
+        return {
+            'motor': PARKING_TARIFF['motor']['hourly'] * utilization * hours_per_day,
+            'mobil': PARKING_TARIFF['mobil']['hourly'] * utilization * hours_per_day
+        }
+    
+    def _estimate_parking_revenue(self, area_m2: float, parking_type: str,
+                                  capacity: Dict = None) -> Dict:
+        """Estimate parking revenue (pass `capacity` to skip recomputing it)"""
+        if capacity is None:
+            capacity = self._estimate_capacity(area_m2, parking_type)
+        coeff = self._rev_coeff.get(parking_type) or self._revenue_coefficients(parking_type)
+        
         # Daily revenue
-        motor_revenue = (capacity['motor'] * utilization * 
-                        PARKING_TARIFF['motor']['hourly'] * hours_per_day)
-        mobil_revenue = (capacity['mobil'] * utilization * 
-                        PARKING_TARIFF['mobil']['hourly'] * hours_per_day)
+        motor_revenue = capacity['motor'] * coeff['motor']
+        mobil_revenue = capacity['mobil'] * coeff['mobil']
         
         daily = motor_revenue + mobil_revenue
         monthly = daily * 26  # 26 working days
@@ -354,62 +574,55 @@ class ParkingDetector:
     
     def _generate_dummy_parking_data(self, roi: ee.Geometry) -> Dict:
         """Generate dummy parking data for demo purposes"""
-        import random
-        random.seed(42)
+        rng = np.random.default_rng(42)
         
         # Get ROI center
         centroid = roi.centroid().coordinates().getInfo()
         center_lon, center_lat = centroid
         
-        # Generate 10-15 dummy parking lots
-        num_parking = random.randint(10, 15)
-        parking_data = []
+        # Generate 10-15 dummy parking lots (random offset from center)
+        num_parking = int(rng.integers(10, 16))
+        lats = center_lat + rng.uniform(-0.01, 0.01, num_parking)
+        lons = center_lon + rng.uniform(-0.01, 0.01, num_parking)
+        areas = rng.uniform(150, 2000, num_parking)
         
-        for i in range(num_parking):
-            # Random offset from center
-            offset_lat = random.uniform(-0.01, 0.01)
-            offset_lon = random.uniform(-0.01, 0.01)
-            
-            lat = center_lat + offset_lat
-            lon = center_lon + offset_lon
-            
-            # Random area
-            area_m2 = random.uniform(150, 2000)
+        # Create rectangular polygons, shape (N, 5, 2)
+        half = np.sqrt(areas) / 111000 / 2  # Approximate size in degrees
+        corner_lon = np.array([-1, 1, 1, -1, -1])
+        corner_lat = np.array([-1, -1, 1, 1, -1])
+        polygons = np.stack([
+            lons[:, None] + half[:, None] * corner_lon,
+            lats[:, None] + half[:, None] * corner_lat
+        ], axis=-1).tolist()
+        
+        parking_data = []
+        for i, (lat, lon, area_m2, coords) in enumerate(zip(lats.tolist(), lons.tolist(), areas.tolist(), polygons)):
             parking_type = self._classify_parking_type(area_m2)
             
             # Revenue
-            revenue = self._estimate_parking_revenue(area_m2, parking_type)
             capacity = self._estimate_capacity(area_m2, parking_type)
-            
-            # Create rectangular polygon
-            size = (area_m2 ** 0.5) / 111000  # Approximate size in degrees
-            coords = [
-                [lon - size/2, lat - size/2],
-                [lon + size/2, lat - size/2],
-                [lon + size/2, lat + size/2],
-                [lon - size/2, lat + size/2],
-                [lon - size/2, lat - size/2]
-            ]
-            
-            parking_data.append({
-                'id': f'PKR-{i+1:03d}',
-                'lat': lat,
-                'lon': lon,
-                'area_m2': round(area_m2, 1),
-                'parking_type': parking_type,
-                'estimated_capacity': capacity,
-                'revenue_daily': revenue['daily'],
-                'revenue_monthly': revenue['monthly'],
-                'revenue_annual': revenue['annual'],
-                'coordinates': coords
-            })
+            revenue = self._estimate_parking_revenue(area_m2, parking_type, capacity)
+            
+            parking_data.append(ParkingRecord(
+                id=f'PKR-{i+1:03d}',
+                lat=lat,
+                lon=lon,
+                area_m2=round(area_m2, 1),
+                parking_type=parking_type,
+                estimated_capacity=capacity,
+                revenue_daily=revenue['daily'],
+                revenue_monthly=revenue['monthly'],
+                revenue_annual=revenue['annual'],
+                coordinates=coords
+            ))
         
+        parking_areas, total_area, total_revenue = self._summarize_records(parking_data)
         return {
             'success': True,
             'count': len(parking_data),
-            'parking_areas': parking_data,
-            'total_area_m2': sum(p['area_m2'] for p in parking_data),
-            'estimated_revenue_annual': sum(p['revenue_annual'] for p in parking_data),
+            'parking_areas': parking_areas,
+            'total_area_m2': total_area,
+            'estimated_revenue_annual': total_revenue,
             'method': 'Dummy Data (Demo Mode)',
             'note': 'Data simulasi untuk demonstrasi. Gunakan data real untuk akurasi.'
         }
@@ -420,75 +633,42 @@ class ParkingDetector:
         
         # Check for OSM source
         is_osm = parking_data.get('source') == 'OpenStreetMap'
-        source_badge = "<span style='background:#10b981;color:white;padding:2px 6px;border-radius:4px;font-size:10px;margin-left:5px;'>Verified via OSM</span>" if is_osm else ""
-        category_row = f"<tr><td style='padding:8px;font-weight:bold;'>🏷️ Kategori</td><td style='padding:8px;'>{parking_data.get('category', 'Komersial')}</td></tr>" if is_osm else ""
+        if is_osm:
+            source_badge = self._SOURCE_BADGE_OSM
+            category_row = self._CATEGORY_ROW_TPL.substitute(category=parking_data.get('category', 'Komersial'))
+        else:
+            source_badge = category_row = ""
 
         # Activity details
         act_score = parking_data.get('activity_score', 0)
-        act_label = ""
         if act_score > 120:
-            act_label = "<div style='color:#10b981; font-weight:bold; font-size:11px;'>🔥 Aktivitas Kendaraan: SANGAT TINGGI</div>"
+            act_label = self._ACT_LABEL_HIGH
         elif act_score > 80:
-            act_label = "<div style='color:#f59e0b; font-weight:bold; font-size:11px;'>🚗 Aktivitas Kendaraan: AKTIF</div>"
+            act_label = self._ACT_LABEL_MID
+        else:
+            act_label = self._ACT_LABEL_NONE
         
-        html = f"""
-        <div style='width: 300px; font-family: Arial, sans-serif;'>
-            <h3 style='margin: 0 0 10px 0; color: #1f2937; border-bottom: 2px solid #FFD700; padding-bottom: 5px;'>
-                🅿️ {parking_data['id']} - {parking_data.get('name', parking_data['parking_type'].title())}
-                {source_badge}
-            </h3>
-            
-            {act_label}
-            
-            <table style='width: 100%; font-size: 13px;'>
-                {category_row}
-                <tr style='background: #f3f4f6;'>
-                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Area</td>
-                    <td style='padding: 8px;'>{parking_data['area_m2']:.1f} m²</td>
-                </tr>
-                <tr>
-                    <td style='padding: 8px; font-weight: bold;'>🏍️ Kapasitas Motor</td>
-                    <td style='padding: 8px;'>{capacity['motor']} slot</td>
-                </tr>
-                <tr style='background: #f3f4f6;'>
-                    <td style='padding: 8px; font-weight: bold;'>🚗 Kapasitas Mobil</td>
-                    <td style='padding: 8px;'>{capacity['mobil']} slot</td>
-                </tr>
-                <tr>
-                    <td style='padding: 8px; font-weight: bold;'>📊 Total Kapasitas</td>
-                    <td style='padding: 8px; font-weight: bold; color: #f59e0b;'>{capacity['total']} kendaraan</td>
-                </tr>
-            </table>
-            
-            <div style='margin-top: 15px; padding: 10px; background: #fef3c7; border-radius: 5px; border-left: 4px solid #f59e0b;'>
-                <div style='font-weight: bold; color: #92400e; margin-bottom: 5px;'>💰 Estimasi Potensi PAD:</div>
-                <div style='font-size: 12px; color: #1f2937;'>
-                    Per Hari: Rp {parking_data['revenue_daily']:,}<br>
-                    Per Bulan: Rp {parking_data['revenue_monthly']:,}<br>
-                    <div style='margin-top: 5px; padding-top: 5px; border-top: 1px solid #fcd34d;'>
-                        <b style='color: #92400e; font-size: 14px;'>Per Tahun: Rp {parking_data['revenue_annual']:,}</b>
-                    </div>
-                </div>
-            </div>
-            
-            <div style='margin-top: 10px; font-size: 11px; color: #6b7280;'>
-                📍 Koordinat: {parking_data['lat']:.5f}, {parking_data['lon']:.5f}
-                <br>
-                <a href='https://earth.google.com/web/search/{parking_data['lat']},{parking_data['lon']}' target='_blank' style='color: #2563eb; text-decoration: none; font-weight: bold;'>
-                    🌍 Buka di Google Earth
-                </a>
-                <div style='margin-top: 5px; font-style: italic; color: #1e40af;'>
-                    💡 Tips: Gunakan fitur 'Historical Imagery' (ikon jam) di Google Earth untuk melihat bukti tahun {parking_data.get('year', '2024')}.
-                </div>
-
-                <!-- AI VALIDATION STATUS -->
-                <div style='margin-top: 10px; padding-top: 5px; border-top: 1px dashed #ccc;'>
-                    {self._get_ai_status_html(parking_data)}
-                </div>
-            </div>
-        </div>
-        """
-        return html
+        lat, lon = parking_data['lat'], parking_data['lon']
+        return self._POPUP_TPL.substitute(
+            id=parking_data['id'],
+            name=parking_data.get('name', parking_data['parking_type'].title()),
+            source_badge=source_badge,
+            act_label=act_label,
+            category_row=category_row,
+            area=format(parking_data['area_m2'], '.1f'),
+            motor=capacity['motor'],
+            mobil=capacity['mobil'],
+            total=capacity['total'],
+            rev_daily=format(parking_data['revenue_daily'], ','),
+            rev_monthly=format(parking_data['revenue_monthly'], ','),
+            rev_annual=format(parking_data['revenue_annual'], ','),
+            lat_fmt=format(lat, '.5f'),
+            lon_fmt=format(lon, '.5f'),
+            lat=lat,
+            lon=lon,
+            year=parking_data.get('year', '2024'),
+            ai_status=self._get_ai_status_html(parking_data)
+        )
 
     def _get_ai_status_html(self, parking_data: Dict) -> str:
         """Get HTML snippet for AI validation status"""
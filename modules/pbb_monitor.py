@@ -4,12 +4,31 @@ Deteksi perubahan bangunan (tinggi dan luas) untuk update nilai pajak
 """
 
 import ee
-from typing import Dict, List
+import numpy as np
+import string
+from functools import lru_cache
+from typing import Dict, List, Tuple
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from config.bkd_config import PBB_RATE, NJOP_ZONE, BUILDING_MIN_AREA
 
+# Annual PBB per m² of added area (assume semi_pusat zone and commercial)
+_TAX_FACTOR = NJOP_ZONE['semi_pusat'] * PBB_RATE['commercial'] / 100.0
+
+
+def _tax(area, height):
+    """PBB increase for added area and height (+10% per 10m); scalars or arrays"""
+    return area * _TAX_FACTOR * np.where(height > 0, 1 + height / 10, 1.0)
+
+
+@lru_cache(maxsize=64)
+def _roi_centroid(roi_json: str) -> Tuple[float, float]:
+    """ROI centroid (lon, lat), fetched once per serialized ROI"""
+    roi = ee.Geometry(ee.deserializer.fromJSON(roi_json))
+    lon, lat = roi.centroid().coordinates().getInfo()
+    return lon, lat
+
 
 class PBBMonitor:
     """
@@ -19,6 +38,71 @@ class PBBMonitor:
     3. Kalkulasi impact terhadap PBB
     """
     
+    # Popup markup is fixed; only the per-building values are substituted
+    _POPUP_TPL = string.Template("""
+        <div style='width: 320px; font-family: Arial, sans-serif;'>
+            <h3 style='margin: 0 0 10px 0; color: #1f2937; border-bottom: 2px solid #3b82f6; padding-bottom: 5px;'>
+                🏢 $id - Perubahan Bangunan
+            </h3>
+            
+            <div style='margin-bottom: 10px;'>
+                $badges
+            </div>
+            
+            <table style='width: 100%; font-size: 13px;'>
+                <tr style='background: #f3f4f6;'>
+                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Lama</td>
+                    <td style='padding: 8px;'>$old_area m²</td>
+                </tr>
+                <tr>
+                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Baru</td>
+                    <td style='padding: 8px; font-weight: bold; color: #3b82f6;'>$new_area m²</td>
+                </tr>
+                <tr style='background: #dbeafe;'>
+                    <td style='padding: 8px; font-weight: bold;'>➕ Penambahan Area</td>
+                    <td style='padding: 8px; font-weight: bold; color: #1e40af;'>+$area_increase m²</td>
+                </tr>
+                <tr style='background: #f3f4f6;'>
+                    <td style='padding: 8px; font-weight: bold;'>📐 Tinggi Lama</td>
+                    <td style='padding: 8px;'>$old_height m</td>
+                </tr>
+                <tr>
+                    <td style='padding: 8px; font-weight: bold;'>📐 Tinggi Baru</td>
+                    <td style='padding: 8px; font-weight: bold; color: #8b5cf6;'>$new_height m</td>
+                </tr>
+                <tr style='background: #ede9fe;'>
+                    <td style='padding: 8px; font-weight: bold;'>➕ Penambahan Tinggi</td>
+                    <td style='padding: 8px; font-weight: bold; color: #6d28d9;'>+$height_increase m</td>
+                </tr>
+            </table>
+            
+            <div style='margin-top: 15px; padding: 10px; background: #dbeafe; border-radius: 5px; border-left: 4px solid #3b82f6;'>
+                <div style='font-weight: bold; color: #1e40af; margin-bottom: 5px;'>💰 Impact PBB:</div>
+                <div style='font-size: 12px; color: #1f2937;'>
+                    NJOP: Rp $njop/m²<br>
+                    Tarif: $tax_rate%<br>
+                    <div style='margin-top: 5px; padding-top: 5px; border-top: 1px solid #93c5fd;'>
+                        <b style='color: #1e40af; font-size: 14px;'>Kenaikan PBB: Rp $tax_increase/tahun</b>
+                    </div>
+                </div>
+            </div>
+            
+            <div style='margin-top: 10px; font-size: 11px; color: #6b7280;'>
+                📍 Koordinat: $lat_fmt, $lon_fmt
+                <br>
+                <a href='https://earth.google.com/web/search/$lat,$lon' target='_blank' style='color: #2563eb; text-decoration: none; font-weight: bold;'>
+                    🌍 Buka di Google Earth
+                </a>
+                <div style='margin-top: 5px; font-style: italic; color: #1e40af;'>
+                    💡 Tips: Klik ikon jam (Historical Imagery) untuk mematikan/menghidupkan layer waktu tahun $year.
+                </div>
+            </div>
+        </div>
+        """)
+    
+    _BADGE_AREA = "<span style='background: #3b82f6; color: white; padding: 2px 6px; border-radius: 3px; font-size: 10px; margin-right: 5px;'>AREA ↗</span>"
+    _BADGE_HEIGHT = "<span style='background: #8b5cf6; color: white; padding: 2px 6px; border-radius: 3px; font-size: 10px;'>HEIGHT ↗</span>"
+    
     def __init__(self):
         self.min_building_area = BUILDING_MIN_AREA
         
@@ -65,37 +149,37 @@ class PBBMonitor:
         For real temporal analysis, need custom building detection
         """
         buildings = ee.FeatureCollection("GOOGLE/Research/open-buildings/v3/polygons")
-        buildings_in_roi = buildings.filterBounds(roi).limit(500)
+        
+        # Filter by area on the server, then pull each property as one flat
+        # array in a single request
+        buildings_in_roi = (buildings.filterBounds(roi)
+                            .filter(ee.Filter.gte('area_in_meters', self.min_building_area))
+                            .limit(500)
+                            .map(lambda f: f.set('ring', f.geometry().coordinates().get(0))))
         
         try:
-            features = buildings_in_roi.getInfo()['features']
+            data = ee.Dictionary({
+                'area': buildings_in_roi.aggregate_array('area_in_meters'),
+                'confidence': buildings_in_roi.aggregate_array('confidence'),
+                'coordinates': buildings_in_roi.aggregate_array('ring'),
+            }).getInfo()
             
-            building_data = []
-            for feature in features:
-                props = feature['properties']
-                geom = feature['geometry']
-                
-                area = props.get('area_in_meters', 0)
-                confidence = props.get('confidence', 0)
-                
-                if area < self.min_building_area:
-                    continue
-                
-                # Get centroid
-                if geom['type'] == 'Polygon':
-                    coords = geom['coordinates'][0]
-                    avg_lat = sum(c[1] for c in coords) / len(coords)
-                    avg_lon = sum(c[0] for c in coords) / len(coords)
-                    
-                    building_data.append({
-                        'lat': avg_lat,
-                        'lon': avg_lon,
-                        'area': area,
-                        'confidence': confidence,
-                        'coordinates': coords
-                    })
+            rings = data['coordinates']
+            if not rings:
+                return []
             
-            return building_data
+            # Centroids (vertex average) for all rings in one reduceat pass
+            lengths = np.fromiter((len(r) for r in rings), dtype=np.intp, count=len(rings))
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            flat = np.array([c[:2] for r in rings for c in r], dtype=np.float64)
+            lon, lat = (np.add.reduceat(flat, offsets, axis=0) / lengths[:, None]).T
+            
+            return [
+                {'lat': la, 'lon': lo, 'area': area, 'confidence': confidence, 'coordinates': coords}
+                for la, lo, area, confidence, coords in zip(
+                    lat.tolist(), lon.tolist(), data['area'], data['confidence'], rings
+                )
+            ]
         except:
             return []
     
@@ -105,50 +189,49 @@ class PBBMonitor:
         This is simplified - real implementation would need spatial matching
         """
         # For demo: assume some buildings expanded
-        changes = []
-        
         # Simulate: 10-20% of buildings have changes
-        import random
-        random.seed(42)
+        rng = np.random.default_rng(42)
         
         num_changes = min(len(buildings_end), max(5, int(len(buildings_end) * 0.15)))
+        if num_changes == 0:
+            return []
         
-        for i in range(num_changes):
-            if i < len(buildings_end):
-                building = buildings_end[i]
-                
-                # Simulate area increase (10-50%)
-                area_increase_pct = random.uniform(0.1, 0.5)
-                old_area = building['area'] / (1 + area_increase_pct)
-                new_area = building['area']
-                
-                # Simulate height change
-                old_height = random.uniform(3, 10)
-                height_increase = random.choice([0, 0, 0, 3, 6, 9])  # Most no change
-                new_height = old_height + height_increase
-                
-                change_type = []
-                if new_area > old_area * 1.1:
-                    change_type.append('area_expansion')
-                if height_increase > 0:
-                    change_type.append('height_increase')
-                
-                if change_type:
-                    changes.append({
-                        'id': f'BLD-{i+1:03d}',
-                        'lat': building['lat'],
-                        'lon': building['lon'],
-                        'old_area': round(old_area, 1),
-                        'new_area': round(new_area, 1),
-                        'area_increase': round(new_area - old_area, 1),
-                        'old_height': round(old_height, 1),
-                        'new_height': round(new_height, 1),
-                        'height_increase': round(height_increase, 1),
-                        'change_type': change_type,
-                        'coordinates': building.get('coordinates', []),
-                        'tax_increase': round((new_area - old_area) * NJOP_ZONE['semi_pusat'] * PBB_RATE['commercial'] / 100 * (1 + (height_increase/10) if height_increase > 0 else 1)),
-                        'file_verification_needed': (new_area - old_area) > 50 or height_increase > 0
-                    })
+        # Simulate area increase (10-50%) and height change (most no change)
+        new_areas = np.fromiter((b['area'] for b in buildings_end[:num_changes]), dtype=np.float64, count=num_changes)
+        old_areas = new_areas / (1 + rng.uniform(0.1, 0.5, num_changes))
+        old_heights = rng.uniform(3, 10, num_changes)
+        height_increases = rng.choice([0, 0, 0, 3, 6, 9], size=num_changes)
+        new_heights = old_heights + height_increases
+        area_increases = new_areas - old_areas
+        taxes = _tax(area_increases, height_increases)
+        
+        changes = []
+        for i, (building, old_area, new_area, area_increase, old_height, new_height, height_increase, tax) in enumerate(zip(
+            buildings_end, old_areas.tolist(), new_areas.tolist(), area_increases.tolist(),
+            old_heights.tolist(), new_heights.tolist(), height_increases.tolist(), taxes.tolist()
+        )):
+            change_type = []
+            if new_area > old_area * 1.1:
+                change_type.append('area_expansion')
+            if height_increase > 0:
+                change_type.append('height_increase')
+            
+            if change_type:
+                changes.append({
+                    'id': f'BLD-{i+1:03d}',
+                    'lat': building['lat'],
+                    'lon': building['lon'],
+                    'old_area': round(old_area, 1),
+                    'new_area': round(new_area, 1),
+                    'area_increase': round(area_increase, 1),
+                    'old_height': round(old_height, 1),
+                    'new_height': round(new_height, 1),
+                    'height_increase': round(height_increase, 1),
+                    'change_type': change_type,
+                    'coordinates': building.get('coordinates', []),
+                    'tax_increase': round(tax),
+                    'file_verification_needed': area_increase > 50 or height_increase > 0
+                })
         
         return changes
     
@@ -156,26 +239,11 @@ class PBBMonitor:
         """
         Calculate PBB impact from building changes
         """
-        total_area_increase = 0
-        total_tax_increase = 0
+        area_increase = np.fromiter((c['area_increase'] for c in changes), dtype=np.float64, count=len(changes))
+        height_increase = np.fromiter((c['height_increase'] for c in changes), dtype=np.float64, count=len(changes))
         
-        for change in changes:
-            area_increase = change['area_increase']
-            total_area_increase += area_increase
-            
-            # Assume semi_pusat zone and commercial
-            njop = NJOP_ZONE['semi_pusat']
-            tax_rate = PBB_RATE['commercial']
-            
-            # PBB increase from area
-            area_tax_increase = area_increase * njop * tax_rate / 100
-            
-            # Additional multiplier for height increase
-            if change['height_increase'] > 0:
-                height_multiplier = 1 + (change['height_increase'] / 10)  # +10% per 10m
-                area_tax_increase *= height_multiplier
-            
-            total_tax_increase += area_tax_increase
+        total_area_increase = float(area_increase.sum())
+        total_tax_increase = float(_tax(area_increase, height_increase).sum())
         
         return {
             'total_buildings_changed': len(changes),
@@ -188,49 +256,45 @@ class PBBMonitor:
         """
         Generate dummy building change data
         """
-        import random
-        random.seed(42)
+        rng = np.random.default_rng(42)
         
         # Get ROI center
-        centroid = roi.centroid().coordinates().getInfo()
-        center_lon, center_lat = centroid
+        center_lon, center_lat = _roi_centroid(roi.serialize())
         
-        # Generate 10-15 building changes
-        num_changes = random.randint(10, 15)
-        changes = []
+        # Generate 10-15 building changes (random offset from center)
+        num_changes = int(rng.integers(10, 16))
+        lats = center_lat + rng.uniform(-0.008, 0.008, num_changes)
+        lons = center_lon + rng.uniform(-0.008, 0.008, num_changes)
         
-        for i in range(num_changes):
-            # Random location
-            offset_lat = random.uniform(-0.008, 0.008)
-            offset_lon = random.uniform(-0.008, 0.008)
-            lat = center_lat + offset_lat
-            lon = center_lon + offset_lon
-            
-            # Random changes
-            old_area = random.uniform(100, 400)
-            area_increase = random.uniform(20, 150)
-            new_area = old_area + area_increase
-            
-            old_height = random.uniform(3, 12)
-            height_increase = random.choice([0, 0, 0, 3, 6, 9])
-            new_height = old_height + height_increase
-            
+        # Random changes
+        old_areas = rng.uniform(100, 400, num_changes)
+        area_increases = rng.uniform(20, 150, num_changes)
+        new_areas = old_areas + area_increases
+        old_heights = rng.uniform(3, 12, num_changes)
+        height_increases = rng.choice([0, 0, 0, 3, 6, 9], size=num_changes)
+        new_heights = old_heights + height_increases
+        taxes = _tax(area_increases, height_increases)
+        
+        # Create square polygons, shape (N, 5, 2)
+        half = np.sqrt(new_areas) / 111000 / 2
+        corner_lon = np.array([-1, 1, 1, -1, -1])
+        corner_lat = np.array([-1, -1, 1, 1, -1])
+        polygons = np.stack([
+            lons[:, None] + half[:, None] * corner_lon,
+            lats[:, None] + half[:, None] * corner_lat
+        ], axis=-1).tolist()
+        
+        changes = []
+        for i, (lat, lon, old_area, new_area, area_increase, old_height, new_height, height_increase, tax, coords) in enumerate(zip(
+            lats.tolist(), lons.tolist(), old_areas.tolist(), new_areas.tolist(), area_increases.tolist(),
+            old_heights.tolist(), new_heights.tolist(), height_increases.tolist(), taxes.tolist(), polygons
+        )):
             change_type = []
             if area_increase > 10:
                 change_type.append('area_expansion')
             if height_increase > 0:
                 change_type.append('height_increase')
             
-            # Create polygon
-            size = (new_area ** 0.5) / 111000
-            coords = [
-                [lon - size/2, lat - size/2],
-                [lon + size/2, lat - size/2],
-                [lon + size/2, lat + size/2],
-                [lon - size/2, lat + size/2],
-                [lon - size/2, lat - size/2]
-            ]
-            
             changes.append({
                 'id': f'BLD-{i+1:03d}',
                 'lat': lat,
@@ -242,9 +306,8 @@ class PBBMonitor:
                 'new_height': round(new_height, 1),
                 'height_increase': round(height_increase, 1),
                 'change_type': change_type,
-                'change_type': change_type,
                 'coordinates': coords,
-                'tax_increase': round(area_increase * NJOP_ZONE['semi_pusat'] * PBB_RATE['commercial'] / 100 * (1 + (height_increase/10) if height_increase > 0 else 1)),
+                'tax_increase': round(tax),
                 'file_verification_needed': area_increase > 50 or height_increase > 0
             })
         
@@ -265,82 +328,30 @@ class PBBMonitor:
         """Create HTML popup for building change"""
         
         # Calculate tax increase
-        area_increase = change_data['area_increase']
-        njop = NJOP_ZONE['semi_pusat']
-        tax_rate = PBB_RATE['commercial']
-        
-        tax_increase = area_increase * njop * tax_rate / 100
-        if change_data['height_increase'] > 0:
-            height_mult = 1 + (change_data['height_increase'] / 10)
-            tax_increase *= height_mult
+        tax_increase = float(_tax(change_data['area_increase'], change_data['height_increase']))
         
         # Change type badges
         badges = []
         if 'area_expansion' in change_data['change_type']:
-            badges.append("<span style='background: #3b82f6; color: white; padding: 2px 6px; border-radius: 3px; font-size: 10px; margin-right: 5px;'>AREA ↗</span>")
+            badges.append(self._BADGE_AREA)
         if 'height_increase' in change_data['change_type']:
-            badges.append("<span style='background: #8b5cf6; color: white; padding: 2px 6px; border-radius: 3px; font-size: 10px;'>HEIGHT ↗</span>")
+            badges.append(self._BADGE_HEIGHT)
         
-        badges_html = ''.join(badges)
-        
-        html = f"""
-        <div style='width: 320px; font-family: Arial, sans-serif;'>
-            <h3 style='margin: 0 0 10px 0; color: #1f2937; border-bottom: 2px solid #3b82f6; padding-bottom: 5px;'>
-                🏢 {change_data['id']} - Perubahan Bangunan
-            </h3>
-            
-            <div style='margin-bottom: 10px;'>
-                {badges_html}
-            </div>
-            
-            <table style='width: 100%; font-size: 13px;'>
-                <tr style='background: #f3f4f6;'>
-                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Lama</td>
-                    <td style='padding: 8px;'>{change_data['old_area']:.1f} m²</td>
-                </tr>
-                <tr>
-                    <td style='padding: 8px; font-weight: bold;'>📏 Luas Baru</td>
-                    <td style='padding: 8px; font-weight: bold; color: #3b82f6;'>{change_data['new_area']:.1f} m²</td>
-                </tr>
-                <tr style='background: #dbeafe;'>
-                    <td style='padding: 8px; font-weight: bold;'>➕ Penambahan Area</td>
-                    <td style='padding: 8px; font-weight: bold; color: #1e40af;'>+{change_data['area_increase']:.1f} m²</td>
-                </tr>
-                <tr style='background: #f3f4f6;'>
-                    <td style='padding: 8px; font-weight: bold;'>📐 Tinggi Lama</td>
-                    <td style='padding: 8px;'>{change_data['old_height']:.1f} m</td>
-                </tr>
-                <tr>
-                    <td style='padding: 8px; font-weight: bold;'>📐 Tinggi Baru</td>
-                    <td style='padding: 8px; font-weight: bold; color: #8b5cf6;'>{change_data['new_height']:.1f} m</td>
-                </tr>
-                <tr style='background: #ede9fe;'>
-                    <td style='padding: 8px; font-weight: bold;'>➕ Penambahan Tinggi</td>
-                    <td style='padding: 8px; font-weight: bold; color: #6d28d9;'>+{change_data['height_increase']:.1f} m</td>
-                </tr>
-            </table>
-            
-            <div style='margin-top: 15px; padding: 10px; background: #dbeafe; border-radius: 5px; border-left: 4px solid #3b82f6;'>
-                <div style='font-weight: bold; color: #1e40af; margin-bottom: 5px;'>💰 Impact PBB:</div>
-                <div style='font-size: 12px; color: #1f2937;'>
-                    NJOP: Rp {njop:,}/m²<br>
-                    Tarif: {tax_rate}%<br>
-                    <div style='margin-top: 5px; padding-top: 5px; border-top: 1px solid #93c5fd;'>
-                        <b style='color: #1e40af; font-size: 14px;'>Kenaikan PBB: Rp {int(tax_increase):,}/tahun</b>
-                    </div>
-                </div>
-            </div>
-            
-            <div style='margin-top: 10px; font-size: 11px; color: #6b7280;'>
-                📍 Koordinat: {change_data['lat']:.5f}, {change_data['lon']:.5f}
-                <br>
-                <a href='https://earth.google.com/web/search/{change_data['lat']},{change_data['lon']}' target='_blank' style='color: #2563eb; text-decoration: none; font-weight: bold;'>
-                    🌍 Buka di Google Earth
-                </a>
-                <div style='margin-top: 5px; font-style: italic; color: #1e40af;'>
-                    💡 Tips: Klik ikon jam (Historical Imagery) untuk mematikan/menghidupkan layer waktu tahun {change_data.get('year', 'analisis')}.
-                </div>
-            </div>
-        </div>
-        """
-        return html
+        return self._POPUP_TPL.substitute(
+            id=change_data['id'],
+            badges=''.join(badges),
+            old_area=f"{change_data['old_area']:.1f}",
+            new_area=f"{change_data['new_area']:.1f}",
+            area_increase=f"{change_data['area_increase']:.1f}",
+            old_height=f"{change_data['old_height']:.1f}",
+            new_height=f"{change_data['new_height']:.1f}",
+            height_increase=f"{change_data['height_increase']:.1f}",
+            njop=f"{NJOP_ZONE['semi_pusat']:,}",
+            tax_rate=PBB_RATE['commercial'],
+            tax_increase=f"{int(tax_increase):,}",
+            lat_fmt=f"{change_data['lat']:.5f}",
+            lon_fmt=f"{change_data['lon']:.5f}",
+            lat=change_data['lat'],
+            lon=change_data['lon'],
+            year=change_data.get('year', 'analisis')
+        )
@@ -1,8 +1,56 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import geopandas as gpd
-from shapely.geometry import Point, LineString
-from typing import List, Dict, Optional
+from shapely.geometry import Point, LineString, box
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import pandas as pd
+import shapely
+from shapely.strtree import STRtree
+
+# Optional: persist Overpass responses on disk
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+
+# Metric CRS for length calculations (UTM zone 50S covers Mataram)
+METRIC_CRS = 'EPSG:32750'
+
+# Overpass requests are issued per fixed grid tile so adjacent kecamatan
+# share cached responses
+OSM_TILE_DEG = 0.02
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+OSM_CACHE_PATH = os.path.join(CACHE_DIR, 'osm')
+OSM_CACHE_EXPIRE = 86400  # seconds
+OSM_MAX_WORKERS = 2  # overpass-api.de grants ~2 concurrent slots per IP
+# Back off and retry when Overpass is busy (429) or times out (504)
+OSM_RETRY = Retry(
+    total=3, backoff_factor=2, status_forcelist=(429, 502, 503, 504),
+    allowed_methods=('GET',), respect_retry_after_header=True,
+)
+
+# Overpass query for named roads/streets in a (south, west, north, east) bbox
+OVERPASS_QUERY = (
+    '[out:json][timeout:60];'
+    '(way["highway"~"primary|secondary|tertiary|residential|service|unclassified|living_street|pedestrian|footway|path"]'
+    '["name"]({s},{w},{n},{e}););'
+    'out geom;'
+)
+
+
+class PartialStreetsError(Exception):
+    """Some Overpass tiles failed; carries the streets of the tiles that succeeded."""
+    
+    def __init__(self, streets: gpd.GeoDataFrame, failed: int, total: int):
+        super().__init__(f"{failed}/{total} Overpass tiles failed, streets are incomplete")
+        self.streets = streets
 
 
 class StreetMapper:
@@ -17,9 +65,55 @@ class StreetMapper:
         Args:
             geojson_path: Path to 5271sls.geojson file
         """
-        self.sls_gdf = gpd.read_file(geojson_path)
+        self.sls_gdf = self._load_sls(geojson_path)
+        
+        # Extract Lingkungan from nmsls once (e.g. "RT 009 LINGKUNGAN GATEP")
+        self.sls_gdf['lingkungan'] = self.sls_gdf['nmsls'].str.split('LINGKUNGAN', n=1).str[-1].str.strip()
+        
+        # Spatial index over SLS polygons in the metric CRS, built once and
+        # queried in bulk
+        self.sls_geoms = self.sls_gdf.geometry.to_crs(METRIC_CRS).values
+        self.sls_tree = STRtree(self.sls_geoms)
+        self.sls_meta = self.sls_gdf[['nmsls', 'lingkungan', 'nmdesa']].to_records(index=False)
+        
         self.overpass_url = "http://overpass-api.de/api/interpreter"
         
+        # In-process cache per Kecamatan (map display and export fetch the same data)
+        self._fetch_streets_cached = lru_cache(maxsize=32)(self._fetch_streets)
+        
+        if requests_cache is not None:
+            os.makedirs(os.path.dirname(OSM_CACHE_PATH), exist_ok=True)
+            self.session = requests_cache.CachedSession(
+                OSM_CACHE_PATH, backend='sqlite', expire_after=OSM_CACHE_EXPIRE
+            )
+        else:
+            self.session = requests.Session()
+        
+        # Keep-alive connection pool shared by tile requests, gzip responses
+        self.session.headers['Accept-Encoding'] = 'gzip'
+        adapter = HTTPAdapter(pool_connections=OSM_MAX_WORKERS, pool_maxsize=OSM_MAX_WORKERS,
+                              max_retries=OSM_RETRY)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+    def _load_sls(self, geojson_path: str) -> gpd.GeoDataFrame:
+        """Load SLS boundaries, via a GeoParquet copy when it is up to date."""
+        cache_path = os.path.join(CACHE_DIR, os.path.basename(geojson_path) + '.parquet')
+        
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(geojson_path):
+                return gpd.read_parquet(cache_path)
+        except (OSError, ImportError, ValueError):
+            pass
+        
+        sls_gdf = gpd.read_file(geojson_path)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            sls_gdf.to_parquet(cache_path)
+        except (OSError, ImportError) as e:
+            print(f"Could not write SLS cache: {e}")
+        return sls_gdf
+        
     def get_kecamatan_list(self) -> List[str]:
         """Get unique list of Kecamatan names from SLS data."""
         return sorted(self.sls_gdf['nmkec'].unique().tolist())
@@ -34,8 +128,21 @@ class StreetMapper:
         Returns:
             GeoDataFrame with street LineStrings and names
         """
+        try:
+            return self._fetch_streets_cached(kecamatan.upper())
+        except PartialStreetsError as e:
+            # Not cached either, so the failed tiles are retried next call
+            print(f"Warning fetching OSM data: {e}")
+            return e.streets
+        except Exception as e:
+            # Failed fetches raise out of the cache, so they are retried next call
+            print(f"Error fetching OSM data: {e}")
+            return gpd.GeoDataFrame()
+    
+    def _fetch_streets(self, kecamatan: str) -> gpd.GeoDataFrame:
+        """Fetch and build the street GeoDataFrame for an upper-cased Kecamatan name."""
         # Filter SLS data by kecamatan
-        kec_data = self.sls_gdf[self.sls_gdf['nmkec'] == kecamatan.upper()]
+        kec_data = self.sls_gdf[self.sls_gdf['nmkec'] == kecamatan]
         
         if kec_data.empty:
             return gpd.GeoDataFrame()
@@ -45,46 +152,74 @@ class StreetMapper:
         min_lat, min_lon = bounds[1], bounds[0]
         max_lat, max_lon = bounds[3], bounds[2]
         
-        # Overpass query for roads/streets
-        query = f"""
-        [out:json][timeout:60];
-        (
-          way["highway"~"primary|secondary|tertiary|residential|service|unclassified|living_street|pedestrian|footway|path"]["name"]({min_lat},{min_lon},{max_lat},{max_lon});
-        );
-        out geom;
-        """
+        # Fetch per grid tile, dedupe ways shared by neighbouring tiles
+        tiles = self._tile_bbox(min_lat, min_lon, max_lat, max_lon)
+        with ThreadPoolExecutor(max_workers=OSM_MAX_WORKERS) as executor:
+            futures = [executor.submit(self._fetch_tile, tile) for tile in tiles]
         
-        try:
-            response = requests.get(self.overpass_url, params={'data': query}, timeout=90)
-            data = response.json()
-            
-            streets = []
-            for element in data.get('elements', []):
-                if element['type'] == 'way' and 'geometry' in element:
-                    # Extract coordinates
-                    coords = [(node['lon'], node['lat']) for node in element['geometry']]
-                    if len(coords) >= 2:
-                        line = LineString(coords)
-                        name = element.get('tags', {}).get('name', 'Jalan Tanpa Nama')
-                        highway_type = element.get('tags', {}).get('highway', 'unknown')
-                        osm_id = element.get('id', 0)
-                        
-                        streets.append({
-                            'osm_id': osm_id,
-                            'name': name,
-                            'highway_type': highway_type,
-                            'geometry': line,
-                            'coords_list': coords  # Keep for easy map rendering
-                        })
-            
-            if streets:
-                return gpd.GeoDataFrame(streets, crs='EPSG:4326')
-            else:
-                return gpd.GeoDataFrame()
-                
-        except Exception as e:
-            print(f"Error fetching OSM data: {e}")
-            return gpd.GeoDataFrame()
+        # One failed tile does not drop the others; only all failing is an error
+        tile_elements, errors = [], []
+        for future in futures:
+            try:
+                tile_elements.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if len(errors) == len(tiles):
+            raise errors[0]
+        
+        elements = {}
+        for tile_result in tile_elements:
+            for element in tile_result:
+                elements.setdefault(element.get('id', 0), element)
+        
+        # Tiles extend past the kecamatan; keep ways touching its bbox
+        kec_box = box(min_lon, min_lat, max_lon, max_lat)
+        
+        streets = []
+        for element in elements.values():
+            if element['type'] == 'way' and 'geometry' in element:
+                # Extract coordinates
+                coords = [(node['lon'], node['lat']) for node in element['geometry']]
+                if len(coords) >= 2:
+                    line = LineString(coords)
+                    if not line.intersects(kec_box):
+                        continue
+                    name = element.get('tags', {}).get('name', 'Jalan Tanpa Nama')
+                    highway_type = element.get('tags', {}).get('highway', 'unknown')
+                    osm_id = element.get('id', 0)
+                    
+                    streets.append({
+                        'osm_id': osm_id,
+                        'name': name,
+                        'highway_type': highway_type,
+                        'geometry': line,
+                        'coords_list': coords  # Keep for easy map rendering
+                    })
+        
+        result = gpd.GeoDataFrame(streets, crs='EPSG:4326') if streets else gpd.GeoDataFrame()
+        if errors:
+            raise PartialStreetsError(result, len(errors), len(tiles))
+        return result
+    
+    def _tile_bbox(self, min_lat: float, min_lon: float,
+                   max_lat: float, max_lon: float) -> List[Tuple[float, float, float, float]]:
+        """Split a bbox into OSM_TILE_DEG grid tiles (south, west, north, east)."""
+        lat_range = range(math.floor(min_lat / OSM_TILE_DEG), math.ceil(max_lat / OSM_TILE_DEG))
+        lon_range = range(math.floor(min_lon / OSM_TILE_DEG), math.ceil(max_lon / OSM_TILE_DEG))
+        return [
+            (round(i * OSM_TILE_DEG, 4), round(j * OSM_TILE_DEG, 4),
+             round((i + 1) * OSM_TILE_DEG, 4), round((j + 1) * OSM_TILE_DEG, 4))
+            for i in lat_range for j in lon_range
+        ]
+    
+    def _fetch_tile(self, tile: Tuple[float, float, float, float]) -> List[Dict]:
+        """Fetch named street ways inside one tile from Overpass (cached on disk)."""
+        s, w, n, e = tile
+        query = OVERPASS_QUERY.format(s=s, w=w, n=n, e=e)
+        
+        response = self.session.get(self.overpass_url, params={'data': query}, timeout=90)
+        response.raise_for_status()
+        return response.json().get('elements', [])
     
     def map_streets_to_admin(self, kecamatan: str) -> pd.DataFrame:
         """
@@ -112,12 +247,10 @@ class StreetMapper:
         results = []
         
         # We use the full sls_gdf instead of just the selected kecamatan 
-        # to handle streets that are on the border or slightly outside
-        search_gdf = self.sls_gdf.copy()
-        
+        # to handle streets that are on the border or slightly outside.
         # Ensure same CRS
-        if streets_gdf.crs != search_gdf.crs:
-            streets_gdf = streets_gdf.to_crs(search_gdf.crs)
+        if streets_gdf.crs != self.sls_gdf.crs:
+            streets_gdf = streets_gdf.to_crs(self.sls_gdf.crs)
         
         # Group by name to treat fragmented ways as single streets
         # This is more accurate for coverage calculation
@@ -133,107 +266,78 @@ class StreetMapper:
         else:
             dissolved_streets = streets_gdf
 
-        for idx, street_row in dissolved_streets.iterrows():
-            street_geom = street_row['geometry']
-            street_name = street_row['name']
-            street_length = street_geom.length
-            
-            # Get centroid for coordinate reference
-            centroid = street_geom.centroid
-            lat = round(centroid.y, 6)
-            lon = round(centroid.x, 6)
+        # Administrative Assignment Logic (Hierarchical & Strict)
+        # Thresholds: RT >= 95%, Lingkungan >= 95%
+        RT_THRESHOLD = 95.0
+        LINGKUNGAN_THRESHOLD = 95.0
+        
+        best_kel, best_lingk, best_rt = {}, {}, {}
+        if not dissolved_streets.empty:
+            # One batched STRtree query yields all (street, SLS) candidate pairs,
+            # then a single vectorized intersection; lengths in meters
+            street_geoms = dissolved_streets.geometry.to_crs(METRIC_CRS).values
+            street_idx, sls_idx = self.sls_tree.query(street_geoms, predicate='intersects')
+            segments = shapely.intersection(street_geoms[street_idx], self.sls_geoms[sls_idx])
+            meta = self.sls_meta[sls_idx]
+            inter = pd.DataFrame({
+                'name': dissolved_streets['name'].values[street_idx],
+                'nmsls': meta['nmsls'],
+                'lingkungan': meta['lingkungan'],
+                'nmdesa': meta['nmdesa'],
+                'seg_len': shapely.length(segments),
+            })
+            inter = inter[inter['seg_len'] > 0]
+            street_len = pd.Series(shapely.length(street_geoms), index=dissolved_streets['name'].values)
+            inter['coverage'] = inter['seg_len'] / inter['name'].map(street_len) * 100
             
-            # Find all SLS features that intersect with this street
-            intersections = []
+            # Collapse intersections to one row per (street, SLS); the three
+            # levels below then aggregate this small frame
+            sls_cov = inter.groupby(['name', 'nmdesa', 'lingkungan', 'nmsls'], as_index=False)['coverage'].sum()
             
-            # Efficient spatial search
-            possible_matches_index = search_gdf.sindex.query(street_geom, predicate='intersects')
-            possible_matches = search_gdf.iloc[possible_matches_index]
+            # 1. Kelurahan Best Match (Fallback baseline)
+            kel_cov = sls_cov.groupby(['name', 'nmdesa'])['coverage'].sum()
+            best_kel = kel_cov.loc[kel_cov.groupby(level=0).idxmax()]
             
-            for _, boundary in possible_matches.iterrows():
-                try:
-                    intersection = boundary['geometry'].intersection(street_geom)
-                    if hasattr(intersection, 'length') and intersection.length > 0:
-                        coverage_pct = (intersection.length / street_length) * 100
-                        
-                        # Extract Lingkungan from nmsls
-                        nmsls_val = boundary['nmsls']
-                        if 'LINGKUNGAN' in nmsls_val:
-                            parts = nmsls_val.split('LINGKUNGAN', 1)
-                            lingk_name = parts[1].strip() if len(parts) > 1 else nmsls_val
-                        else:
-                            lingk_name = nmsls_val
-                            
-                        intersections.append({
-                            'nmsls': nmsls_val,
-                            'lingkungan': lingk_name,
-                            'kelurahan': boundary['nmdesa'],
-                            'coverage': coverage_pct
-                        })
-                except:
-                    continue
+            # 2. Lingkungan within the best Kelurahan
+            kel_of = dict(best_kel.index)
+            in_kel = sls_cov[sls_cov['nmdesa'] == sls_cov['name'].map(kel_of)]
+            lingk_cov = in_kel.groupby(['name', 'lingkungan'])['coverage'].sum()
+            best_lingk = lingk_cov.loc[lingk_cov.groupby(level=0).idxmax()]
+            best_lingk = best_lingk[best_lingk >= LINGKUNGAN_THRESHOLD]
             
-            # Administrative Assignment Logic (Hierarchical & Strict)
-            # Thresholds: RT >= 95%, Lingkungan >= 95%
-            RT_THRESHOLD = 95.0
-            LINGKUNGAN_THRESHOLD = 95.0
+            # 3. Specific RT (SLS) within the best Lingkungan
+            lingk_of = dict(best_lingk.index)
+            in_lingk = in_kel[in_kel['lingkungan'] == in_kel['name'].map(lingk_of)]
+            rt_cov = in_lingk.groupby(['name', 'nmsls'])['coverage'].sum()
+            best_rt = rt_cov.loc[rt_cov.groupby(level=0).idxmax()]
+            best_rt = best_rt[best_rt >= RT_THRESHOLD]
             
+            best_kel = {name: (kel, cov) for (name, kel), cov in best_kel.items()}
+            best_lingk = {name: (lk, cov) for (name, lk), cov in best_lingk.items()}
+            best_rt = {name: (rt, cov) for (name, rt), cov in best_rt.items()}
+        
+        # Centroids for coordinate reference, computed for all streets at once
+        centroids = shapely.centroid(np.asarray(dissolved_streets.geometry.values))
+        lats = shapely.get_y(centroids).round(6).tolist()
+        lons = shapely.get_x(centroids).round(6).tolist()
+        
+        for street_name, lat, lon in zip(dissolved_streets['name'], lats, lons):
             assigned_sls = "-"
             assigned_lingk = "-"
             assigned_kel = "-"
             final_coverage_info = "No match"
             
-            if intersections:
-                # 1. Check for Kelurahan Best Match (Fallback baseline)
-                kel_stats = {}
-                for inter in intersections:
-                    kl = inter['kelurahan']
-                    if kl not in kel_stats:
-                        kel_stats[kl] = 0
-                    kel_stats[kl] += inter['coverage']
-                
-                best_kel_name = max(kel_stats, key=kel_stats.get)
-                assigned_kel = best_kel_name
-                final_coverage_info = f"Kelurahan Only ({kel_stats[best_kel_name]:.1f}%)"
-                
-                # 2. Check for Lingkungan within the best Kelurahan
-                lingk_stats = {}
-                for inter in intersections:
-                    if inter['kelurahan'] == best_kel_name:
-                        lk = inter['lingkungan']
-                        if lk not in lingk_stats:
-                            lingk_stats[lk] = 0
-                        lingk_stats[lk] += inter['coverage']
+            if street_name in best_kel:
+                assigned_kel, kel_coverage = best_kel[street_name]
+                final_coverage_info = f"Kelurahan Only ({kel_coverage:.1f}%)"
                 
-                if lingk_stats:
-                    best_lingk_name = max(lingk_stats, key=lingk_stats.get)
-                    best_lingk_coverage = lingk_stats[best_lingk_name]
+                if street_name in best_lingk:
+                    assigned_lingk, lingk_coverage = best_lingk[street_name]
+                    final_coverage_info = f"{lingk_coverage:.1f}% (Lingk)"
                     
-                    # Apply Lingkungan threshold (90%)
-                    if best_lingk_coverage >= LINGKUNGAN_THRESHOLD:
-                        assigned_lingk = best_lingk_name
-                        final_coverage_info = f"{best_lingk_coverage:.1f}% (Lingk)"
-                        
-                        # 3. Check for specific RT (SLS) within the best Lingkungan
-                        rt_stats = {}
-                        for inter in intersections:
-                            if inter['kelurahan'] == best_kel_name and inter['lingkungan'] == best_lingk_name:
-                                rt = inter['nmsls']
-                                if rt not in rt_stats:
-                                    rt_stats[rt] = 0
-                                rt_stats[rt] += inter['coverage']
-                        
-                        if rt_stats:
-                            best_rt_name = max(rt_stats, key=rt_stats.get)
-                            best_rt_coverage = rt_stats[best_rt_name]
-                            
-                            # Apply RT threshold (95%)
-                            if best_rt_coverage >= RT_THRESHOLD:
-                                assigned_sls = best_rt_name
-                                final_coverage_info = f"{best_rt_coverage:.1f}% (RT)"
-                    else:
-                        # Best Lingkungan is < Lingkungan Threshold
-                        pass
+                    if street_name in best_rt:
+                        assigned_sls, rt_coverage = best_rt[street_name]
+                        final_coverage_info = f"{rt_coverage:.1f}% (RT)"
 
             # Create validation links
             google_maps_link = f"https://www.google.com/maps?q={lat},{lon}"
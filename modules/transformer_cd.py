@@ -1,7 +1,60 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
 import torch
+import torchvision.transforms.v2.functional as TF
+import transformers
 from transformers import SegformerImageProcessor, SegformerForSemanticSegmentation
-from PIL import Image
 import numpy as np
+from contextlib import nullcontext
+
+# Fused attention kernels (torch >= 2.3)
+try:
+    from torch.nn.attention import sdpa_kernel, SDPBackend
+except ImportError:
+    sdpa_kernel = None
+
+# Optional: fast content hashing for the mask cache (falls back to blake2b)
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Optional: ONNX Runtime backend (TensorRT/CUDA/CPU execution providers)
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:
+    ort = None
+
+ONNX_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'onnx')
+
+# FP32 only: SegFormer attention overflows in FP16 and silently corrupts masks
+ORT_GPU_PROVIDERS = [
+    ('TensorrtExecutionProvider', {
+        'trt_fp16_enable': False,
+        'trt_engine_cache_enable': True,
+        'trt_engine_cache_path': ONNX_CACHE_DIR,
+    }),
+    'CUDAExecutionProvider',
+]
+
+def _bf16_supported(device_type):
+    """Whether bfloat16 matmuls run natively (not emulated) on this device type"""
+    if device_type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    # AVX-512 BF16 / AMX; elsewhere autocast would only add casts
+    is_supported = getattr(torch.cpu, '_is_avx512_bf16_supported', None)
+    return bool(is_supported and is_supported())
+
+# Scenes larger than this (pixels per side) are predicted tile by tile
+TILED_MIN_SIDE = 2048
+TILE_OVERLAP = 32
+TILE_BATCH = 8
+
+# Building masks kept per image content (LRU), e.g. a T1 chip re-run against new T2s
+MASK_CACHE_SIZE = 32
 
 class TransformerChangeDetector:
     """
@@ -15,22 +68,37 @@ class TransformerChangeDetector:
     detecting buildings (Class ID 2).
     """
     
-    def __init__(self, device='cpu'):
+    def __init__(self, device='cpu', quantize=True, compile=True):
         self.device = device
+        # INT8 dynamic quantization of Linear/MatMul weights, CPU only
+        self.quantize = quantize and device == 'cpu'
+        # TorchInductor fused kernels for the PyTorch backend
+        self.compile = compile and hasattr(torch, 'compile')
         # Model fine-tuned on LoveDA (Land-Cover Domain Adaptive)
         # Class 1 = Building in LoveDA dataset
         self.model_name = "wu-pr-gw/segformer-b2-finetuned-with-LoveDA" 
         self.processor = None
         self.model = None
+        self.ort_session = None
+        self.channels_last = False
+        self.use_bf16 = False
+        self.input_size = None
+        self.mean = None
+        self.std = None
+        # CUDA upload staging: reused pinned host buffer + dedicated copy stream
+        self._host_buf = None
+        self._copy_stream = None
+        # The detector is a process-wide singleton shared by Streamlit session
+        # threads; guards the pinned upload buffer and the mask cache
+        self._lock = threading.Lock()
+        self._mask_cache = OrderedDict()
         self.is_ready = False
         
     def load_model(self):
         try:
             print(f"Loading Satellite AI: {self.model_name}...")
-            self.processor = SegformerImageProcessor.from_pretrained(self.model_name)
-            self.model = SegformerForSemanticSegmentation.from_pretrained(self.model_name)
-            self.model.to(self.device)
-            self.model.eval()
+            self._load_pretrained()
+            self._setup_loaded_model()
             self.is_ready = True
             print("✅ Satellite AI Model Loaded (LoveDA Dataset)")
             return True
@@ -39,79 +107,448 @@ class TransformerChangeDetector:
             print("⚠️ Falling back to ADE20K model...")
             self.model_name = "nvidia/segformer-b0-finetuned-ade20k-512-1024"
             try:
-                self.processor = SegformerImageProcessor.from_pretrained(self.model_name)
-                self.model = SegformerForSemanticSegmentation.from_pretrained(self.model_name)
-                self.model.to(self.device)
-                self.model.eval()
+                self._load_pretrained()
+                self._setup_loaded_model()
                 self.is_ready = True
                 return True
             except:
                 return False
 
-    def predict(self, image_array):
+    def _load_pretrained(self):
+        """Load the processor and weights of self.model_name, with SDPA attention when supported"""
+        self.processor = SegformerImageProcessor.from_pretrained(self.model_name)
+        try:
+            self.model = SegformerForSemanticSegmentation.from_pretrained(self.model_name, attn_implementation='sdpa')
+        except ValueError:
+            # transformers versions without SDPA support for SegFormer
+            self.model = SegformerForSemanticSegmentation.from_pretrained(self.model_name)
+
+    def _attention_context(self):
+        """On CUDA, restrict SDPA to the fused FlashAttention / memory-efficient kernels"""
+        if sdpa_kernel is None or self.mean.device.type != 'cuda':
+            return nullcontext()
+        return sdpa_kernel([SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION])
+
+    def _autocast_context(self):
+        """bfloat16 autocast for the PyTorch forward pass, when enabled"""
+        return torch.autocast(device_type=torch.device(self.device).type, dtype=torch.bfloat16, enabled=self.use_bf16)
+
+    def _setup_loaded_model(self):
+        """Move the model to the device and cache everything predict() reuses"""
+        self.model.to(self.device)
+        self.model.eval()
+        with self._lock:
+            self._mask_cache.clear()
+        
+        # Inputs are resized to the processor's fixed size (and tiles share it),
+        # so cuDNN's autotuned conv algorithms are reused on every call
+        if torch.device(self.device).type == 'cuda':
+            torch.backends.cudnn.benchmark = True
+        self._load_onnx_session()
+        
+        # PyTorch fallback path on CPU: quantize Linear layers (attention/MLP)
+        if self.ort_session is None and self.quantize:
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        
+        # PyTorch path: NHWC layout for the oneDNN/cuDNN convolution kernels
+        self.channels_last = self.ort_session is None
+        
+        # bfloat16 autocast keeps FP32's range (FP16 overflows in SegFormer attention);
+        # not combined with the INT8 Linear layers
+        self.use_bf16 = (self.ort_session is None and not self.quantize
+                         and _bf16_supported(torch.device(self.device).type))
+        if self.channels_last:
+            self.model.to(memory_format=torch.channels_last)
+            if self.device == 'cpu':
+                # Single-request inference: keep every thread on intra-op work
+                try:
+                    torch.set_num_interop_threads(1)
+                except RuntimeError:
+                    pass  # already fixed once inter-op work has started
+        
+        # Inputs are normalized on the device the backend reads them from
+        input_device = 'cpu' if self.ort_session is not None else self.device
+        self.input_size = (self.processor.size['height'], self.processor.size['width'])
+        self.mean = torch.tensor(self.processor.image_mean, device=input_device).view(1, 3, 1, 1) * 255.0
+        self.std = torch.tensor(self.processor.image_std, device=input_device).view(1, 3, 1, 1) * 255.0
+        
+        # Pre-allocate room for a full tile batch so uploads never hit cudaHostAlloc
+        if self.mean.device.type == 'cuda':
+            self._copy_stream = torch.cuda.Stream(self.mean.device)
+            self._host_buf = torch.empty(TILE_BATCH * 3 * self.input_size[0] * self.input_size[1],
+                                         dtype=torch.uint8, pin_memory=True)
+        
+        if self.ort_session is None and self.compile:
+            self._compile_model()
+        else:
+            # One dummy pass so cuDNN autotuning / ORT arena setup happen at load time
+            dummy = torch.zeros(1, 3, *self.input_size, device=self.mean.device)
+            self._predict_batch(dummy, self.input_size)
+
+    def _compile_model(self):
         """
-        Run segmentation on a single image array (H, W, Channels)
-        Returns: Binary mask (1=Building, 0=Background)
+        Compile the forward pass with torch.compile and warm it up at the
+        batch sizes predict() runs (1 for single chips, 2 for T1/T2 pairs,
+        up to TILE_BATCH for tiles), so Inductor's fused graphs are built
+        before the first real request. Falls back to eager if compilation fails.
         """
-        if not self.is_ready:
-            return None
+        eager_model = self.model
+        try:
+            # No CUDA graphs ('reduce-overhead'): Inductor keeps recorded graphs and
+            # their memory pool per thread, and Streamlit runs every session/rerun
+            # on a new thread, so the warm-up graphs would never be reused and each
+            # rerun would record again into another pool. Fused kernels still apply
+            mode = 'max-autotune-no-cudagraphs' if self.mean.device.type == 'cuda' else 'default'
+            self.model = torch.compile(eager_model, mode=mode)
             
-        # Convert numpy to PIL
+            # Batch 1 is always specialized; one graph with a dynamic batch
+            # dimension covers pairs and (ragged) tile batches
+            single = self._to_model_layout(torch.zeros(1, 3, *self.input_size, device=self.mean.device))
+            batched = self._to_model_layout(torch.zeros(2, 3, *self.input_size, device=self.mean.device))
+            torch._dynamo.mark_dynamic(batched, 0, min=2, max=max(TILE_BATCH, 2))
+            with torch.inference_mode(), self._attention_context(), self._autocast_context():
+                for dummy in (single, batched):
+                    for _ in range(2):
+                        self.model(pixel_values=dummy)
+            print(f"✅ Satellite AI forward compiled ({mode})")
+        except Exception as e:
+            print(f"⚠️ torch.compile unavailable, using eager PyTorch: {e}")
+            self.model = eager_model
+
+    def _onnx_cache_name(self):
+        """
+        Cache file stem for the exported graph: model, Hub revision and the
+        torch/transformers versions that produced it, so updated weights or
+        an upgraded exporter never reuse a stale graph
+        """
+        revision = (getattr(self.model.config, '_commit_hash', None) or 'local')[:12]
+        return '__'.join([
+            self.model_name.replace('/', '__'), revision,
+            f'torch{torch.__version__}', f'transformers{transformers.__version__}',
+        ])
+
+    def _load_onnx_session(self):
+        """
+        Export the loaded model to ONNX once (cached on disk) and serve it
+        with ONNX Runtime in FP32, or with INT8 weights when quantizing.
+        Falls back to PyTorch if unavailable.
+        """
+        self.ort_session = None
+        if ort is None:
+            return
+        
+        # On a GPU device ORT is only worth it with a GPU execution provider
+        # (the plain onnxruntime wheel is CPU-only); otherwise PyTorch runs on CUDA
+        providers = []
+        if self.device != 'cpu':
+            available = ort.get_available_providers()
+            providers = [p for p in ORT_GPU_PROVIDERS if (p[0] if isinstance(p, tuple) else p) in available]
+            if not providers:
+                print("⚠️ No ONNX Runtime GPU provider (install onnxruntime-gpu), using PyTorch on CUDA")
+                return
+        providers.append('CPUExecutionProvider')
+        
+        try:
+            onnx_path = os.path.join(ONNX_CACHE_DIR, self._onnx_cache_name() + '.onnx')
+            if not os.path.exists(onnx_path):
+                os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+                tmp_path = onnx_path + '.tmp'
+                dummy = torch.zeros(1, 3, 512, 512, device=self.device)
+                torch.onnx.export(
+                    self.model, (dummy,), tmp_path,
+                    input_names=['pixel_values'], output_names=['logits'],
+                    dynamic_axes={'pixel_values': {0: 'batch', 2: 'height', 3: 'width'},
+                                  'logits': {0: 'batch', 2: 'height', 3: 'width'}},
+                    opset_version=17, dynamo=False
+                )
+                os.replace(tmp_path, onnx_path)
+            
+            if self.quantize:
+                int8_path = onnx_path[:-len('.onnx')] + '.int8.onnx'
+                if not os.path.exists(int8_path):
+                    tmp_path = int8_path + '.tmp'
+                    quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QInt8)
+                    os.replace(tmp_path, int8_path)
+                onnx_path = int8_path
+            
+            self.ort_session = ort.InferenceSession(onnx_path, providers=providers)
+            backend = self.ort_session.get_providers()[0]
+            
+            # GPU providers can fail to initialize and silently fall back to CPU
+            if self.device != 'cpu' and backend == 'CPUExecutionProvider':
+                print("⚠️ ONNX Runtime GPU provider failed to start, using PyTorch on CUDA")
+                self.ort_session = None
+                return
+            print(f"✅ ONNX Runtime backend: {backend}")
+        except Exception as e:
+            print(f"⚠️ ONNX Runtime unavailable, using PyTorch: {e}")
+            self.ort_session = None
+
+    def _building_class(self):
+        """Class id of 'building' for the loaded model"""
+        if "LoveDA" in self.model_name:
+            # LoveDA Classes:
+            # 0: Background, 1: Building, 2: Road, 3: Water, 4: Barren, 5: Forest, 6: Agriculture
+            # Building is Class 1
+            return 1
+        # ADE20K Fallback
+        # Building class is usually 1 (wall) or 2 (building) - checking index
+        # ADE20K is complex, let's assume class 2 for generic 'building'
+        return 2
+
+    def _to_rgb(self, image_array):
+        """Clean an image array (H, W, Channels) to uint8 RGB"""
         if image_array.dtype != np.uint8:
             image_array = (image_array).astype(np.uint8)
             
         # Handle channels (Sentinel data might have >3, clean to RGB)
         if image_array.shape[2] > 3:
             image_array = image_array[:, :, :3]
+        return image_array
+
+    def _is_large(self, image_array):
+        """Whether an image should go through _predict_tiled"""
+        return max(image_array.shape[:2]) > TILED_MIN_SIDE
+
+    def _to_input_device(self, tensor):
+        """
+        Move a uint8 CPU tensor to the device the backend reads inputs from.
+        On CUDA the copy is staged through the reused pinned buffer and issued
+        asynchronously on the copy stream.
+        """
+        if self._copy_stream is None:
+            return tensor.to(self.mean.device)
+        
+        # Staging and enqueueing must not interleave with another session's upload
+        with self._lock:
+            # The previous upload must have left the pinned buffer before it is reused
+            self._copy_stream.synchronize()
+            if self._host_buf.numel() < tensor.numel():
+                self._host_buf = torch.empty(tensor.numel(), dtype=torch.uint8, pin_memory=True)
+            host = self._host_buf[:tensor.numel()].view(tensor.shape)
+            host.copy_(tensor)
+            
+            with torch.cuda.stream(self._copy_stream):
+                device_tensor = host.to(self.mean.device, non_blocking=True)
             
-        image = Image.fromarray(image_array)
+            # Compute on the default stream waits for the upload, not for the host
+            current = torch.cuda.current_stream(self.mean.device)
+            current.wait_stream(self._copy_stream)
+            device_tensor.record_stream(current)
+        return device_tensor
+
+    def _is_blank(self, image_array):
+        """All-zero chips (masked-out AOIs, missing scenes) contain no buildings"""
+        return not image_array.any()
+
+    def _preprocess(self, image_array):
+        """
+        Convert an image array (H, W, Channels) to model input
+        Returns: (pixel_values tensor (1, 3, h, w), original (height, width))
+        """
+        image_array = self._to_rgb(image_array)
+        size = image_array.shape[:2]
+        
+        # (H, W, 3) uint8 -> (1, 3, H, W) float, without a PIL round trip
+        pixel_values = self._to_input_device(torch.from_numpy(np.ascontiguousarray(image_array)))
+        pixel_values = pixel_values.permute(2, 0, 1).unsqueeze(0)
         
-        # Preprocess
-        inputs = self.processor(images=image, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        # Resize only when the chip is not already at the model's input size
+        # (bilinear on uint8, same as the image processor)
+        if size != self.input_size:
+            pixel_values = TF.resize(
+                pixel_values, list(self.input_size), interpolation=TF.InterpolationMode.BILINEAR, antialias=True
+            )
+        pixel_values = pixel_values.float()
+        
+        # Rescale (1/255) and normalize in one fused in-place pass
+        pixel_values.sub_(self.mean).div_(self.std)
+        return pixel_values, size
+
+    def _to_model_layout(self, pixel_values):
+        """Match the memory format the backend expects (NHWC for PyTorch, NCHW for ORT)"""
+        if self.channels_last:
+            # clone() also gives canonical strides on size-1 dims (e.g. a permuted
+            # single chip); compiled graphs guard on strides and would recompile
+            return pixel_values.clone(memory_format=torch.channels_last)
+        return pixel_values.contiguous()
+
+    def _predict_batch(self, pixel_values, size):
+        """
+        Run one forward pass over a batch of preprocessed images of the same size
+        Returns: Boolean building mask tensor (batch, height, width) on the device
+        """
+        # Layout is fixed here, after batching (torch.cat does not keep channels_last)
+        pixel_values = self._to_model_layout(pixel_values)
         
         # Inference
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits = outputs.logits  # shape (batch_size, num_labels, height/4, width/4)
-
-        # Upsample logits to original image size
-        upsampled_logits = torch.nn.functional.interpolate(
-            logits,
-            size=image.size[::-1], # (height, width)
+        if self.ort_session is not None:
+            logits = self.ort_session.run(['logits'], {'pixel_values': pixel_values.cpu().numpy()})[0]
+            logits = torch.from_numpy(logits).to(self.device)
+        else:
+            with torch.inference_mode(), self._attention_context(), self._autocast_context():
+                outputs = self.model(pixel_values=pixel_values.to(self.device))
+            # Upsample and compare in FP32
+            logits = outputs.logits.float()  # shape (batch_size, num_labels, height/4, width/4)
+
+        # Only "building vs. best other class" matters, so reduce the
+        # num_labels logits to two channels before anything is upsampled
+        c = self._building_class()
+        building = logits[:, c:c + 1]
+        others = torch.cat([logits[:, :c], logits[:, c + 1:]], dim=1).amax(dim=1, keepdim=True)
+
+        # Chips larger than the model input were downscaled before inference:
+        # decide at logit resolution and upsample only the mask
+        if size[0] > self.input_size[0] or size[1] > self.input_size[1]:
+            building_mask = (building > others).to(torch.uint8)
+            return torch.nn.functional.interpolate(building_mask, size=size, mode="nearest")[:, 0].bool()
+
+        # Upsample the two channels to original image size
+        upsampled = torch.nn.functional.interpolate(
+            torch.cat([building, others], dim=1),
+            size=size, # (height, width)
             mode="bilinear",
             align_corners=False,
         )
+        return upsampled[:, 0] > upsampled[:, 1]
 
-        # Get prediction (argmax)
-        pred_seg = upsampled_logits.argmax(dim=1)[0]
+    def _predict_tiled(self, image_array, overlap=TILE_OVERLAP):
+        """
+        Predict a large scene in overlapping tiles at the model's native input size
+        Returns: Binary mask (H, W) uint8, with seams in the middle of each overlap
+        """
+        rgb = self._to_rgb(image_array)
+        H, W = rgb.shape[:2]
+        tile_h, tile_w = self.input_size
+        if H < tile_h or W < tile_w:
+            # Too narrow to tile (e.g. a long strip): predict it whole, resized
+            pixel_values, size = self._preprocess(rgb)
+            return self._predict_batch(pixel_values, size)[0].cpu().numpy().astype(np.uint8)
         
-        # Class mapping logic
-        if "LoveDA" in self.model_name:
-            # LoveDA Classes:
-            # 0: Background, 1: Building, 2: Road, 3: Water, 4: Barren, 5: Forest, 6: Agriculture
-            # Building is Class 1
-            building_mask = (pred_seg == 1).cpu().numpy().astype(np.uint8)
-        else:
-            # ADE20K Fallback
-            # Building class is usually 1 (wall) or 2 (building) - checking index
-            # ADE20K is complex, let's assume class 2 for generic 'building'
-            building_mask = (pred_seg == 2).cpu().numpy().astype(np.uint8)
+        # Tile origins; the last row/column is aligned to the image edge
+        ys = list(range(0, H - tile_h, tile_h - overlap)) + [H - tile_h]
+        xs = list(range(0, W - tile_w, tile_w - overlap)) + [W - tile_w]
+        origins = [(y, x) for y in ys for x in xs]
+        
+        # Zero-copy view of all windows; only the selected ones are stacked
+        windows = np.lib.stride_tricks.sliding_window_view(rgb, (tile_h, tile_w, 3))
         
-        return building_mask
+        out = np.empty((H, W), np.uint8)
+        half = overlap // 2
+        for i in range(0, len(origins), TILE_BATCH):
+            batch = origins[i:i + TILE_BATCH]
+            tiles = np.stack([windows[y, x, 0] for y, x in batch])
+            pixel_values = self._to_input_device(torch.from_numpy(tiles)).permute(0, 3, 1, 2).float()
+            pixel_values.sub_(self.mean).div_(self.std)
+            masks = self._predict_batch(pixel_values, (tile_h, tile_w)).cpu().numpy()
+            
+            # Later tiles overwrite from the middle of their overlap with earlier ones
+            for (y, x), mask in zip(batch, masks):
+                y0 = y + half if y else 0
+                x0 = x + half if x else 0
+                out[y0:y + tile_h, x0:x + tile_w] = mask[y0 - y:, x0 - x:]
+        
+        return out
 
-    def detect_change(self, img_t1, img_t2):
+    def _mask_key(self, image_array):
+        """Content hash of an image (pixels, shape and dtype) for the mask cache"""
+        data = np.ascontiguousarray(image_array)
+        h = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+        h.update(repr((data.shape, data.dtype.str)).encode())
+        h.update(data)
+        return h.digest()
+
+    def _cache_mask(self, key, mask):
+        """Store a mask (read-only, it is shared with callers) and evict the oldest"""
+        mask.flags.writeable = False
+        with self._lock:
+            self._mask_cache[key] = mask
+            if len(self._mask_cache) > MASK_CACHE_SIZE:
+                self._mask_cache.popitem(last=False)
+        return mask
+
+    def _cached_mask(self, key):
+        """Cached mask for a key (marked as recently used), or None"""
+        with self._lock:
+            mask = self._mask_cache.get(key)
+            if mask is not None:
+                self._mask_cache.move_to_end(key)
+        return mask
+
+    def _compute_mask(self, image_array):
+        """Segment a single image; Returns: Binary mask (H, W) uint8"""
+        # Blank chips skip the forward pass entirely
+        if self._is_blank(image_array):
+            return np.zeros(image_array.shape[:2], np.uint8)
+            
+        if self._is_large(image_array):
+            return self._predict_tiled(image_array)
+            
+        pixel_values, size = self._preprocess(image_array)
+        building_mask = self._predict_batch(pixel_values, size)[0]
+        return building_mask.cpu().numpy().astype(np.uint8)
+
+    def predict_mask(self, image_array):
         """
-        Detect structural change between two images.
+        Run segmentation on a single image array (H, W, Channels)
+        Returns: Binary mask (1=Building, 0=Background), read-only
+        """
+        if not self.is_ready:
+            return None
+            
+        key = self._mask_key(image_array)
+        mask = self._cached_mask(key)
+        if mask is None:
+            mask = self._cache_mask(key, self._compute_mask(image_array))
+        return mask
+
+    def predict(self, image_array):
+        """Alias of predict_mask()"""
+        return self.predict_mask(image_array)
+
+    def predict_count(self, image_array):
+        """
+        Run segmentation on a single image array (H, W, Channels)
+        Returns: Number of building pixels
         """
         if not self.is_ready:
-            self.load_model()
+            return None
             
-        mask_t1 = self.predict(img_t1)
-        mask_t2 = self.predict(img_t2)
+        return int(self.predict_mask(image_array).sum(dtype=np.int64))
+
+    def _predict_pair(self, img_t1, img_t2):
+        """
+        Building masks for both timestamps. Cached masks are reused; otherwise
+        same-size chips go through the model in a single batch.
+        """
+        key_t1, key_t2 = self._mask_key(img_t1), self._mask_key(img_t2)
+        mask_t1, mask_t2 = self._cached_mask(key_t1), self._cached_mask(key_t2)
         
-        if mask_t1 is None or mask_t2 is None:
-            return 0.0, "Model Error"
+        if (mask_t1 is None and mask_t2 is None
+                and img_t1.shape[:2] == img_t2.shape[:2]
+                and not (self._is_large(img_t2) or self._is_blank(img_t1) or self._is_blank(img_t2))):
+            pv_t1, size = self._preprocess(img_t1)
+            pv_t2, _ = self._preprocess(img_t2)
+            masks = self._predict_batch(torch.cat([pv_t1, pv_t2], dim=0), size)
+            masks = masks.cpu().numpy().astype(np.uint8)
+            return self._cache_mask(key_t1, masks[0]), self._cache_mask(key_t2, masks[1])
+        
+        if mask_t1 is None:
+            mask_t1 = self._cache_mask(key_t1, self._compute_mask(img_t1))
+        if mask_t2 is None:
+            mask_t2 = self._cache_mask(key_t2, self._compute_mask(img_t2))
+        return mask_t1, mask_t2
+
+    def detect_change(self, img_t1, img_t2):
+        """
+        Detect structural change between two images.
+        The model must be loaded up front (see load_model).
+        """
+        assert self.is_ready, "load_model() must succeed before detect_change()"
+            
+        mask_t1, mask_t2 = self._predict_pair(img_t1, img_t2)
+        building_t1_count = int(mask_t1.sum(dtype=np.int64))
+        building_t2_count = int(mask_t2.sum(dtype=np.int64))
             
         # Calculate Change: Building in T2 but not in T1
         # Logical: T2 AND (NOT T1)
@@ -123,9 +560,6 @@ class TransformerChangeDetector:
         
         # Advanced: IoU or Dice, but for change we focus on new buildings
         
-        building_t1_count = np.sum(mask_t1)
-        building_t2_count = np.sum(mask_t2)
-        
         # If T2 has significantly more building pixels than T1
         if building_t2_count > building_t1_count * 1.1: # Threshold 10% increase
              diff = building_t2_count - building_t1_count
@@ -136,3 +570,23 @@ class TransformerChangeDetector:
              label = "No Structural Change"
              
         return confidence, label
+
+    def detect_change_map(self, img_t1, img_t2):
+        """
+        Pixel-level change map between two images.
+        Returns: Binary mask at T2 resolution (1=Building in T2 but not in T1)
+        """
+        assert self.is_ready, "load_model() must succeed before detect_change_map()"
+            
+        if img_t1.shape[:2] == img_t2.shape[:2]:
+            mask_t1, mask_t2 = self._predict_pair(img_t1, img_t2)
+            return mask_t2 & (1 - mask_t1)
+            
+        pv_t1, _ = self._preprocess(img_t1)
+        pv_t2, size_t2 = self._preprocess(img_t2)
+        
+        # Both logits are upsampled to T2's size so the masks align pixel-wise;
+        # T2 AND (NOT T1) is computed on the device in place
+        masks = self._predict_batch(torch.cat([pv_t1, pv_t2], dim=0), size_t2)
+        change = masks[1].logical_and_(masks[0].logical_not_())
+        return change.cpu().numpy().astype(np.uint8)
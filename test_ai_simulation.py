@@ -11,9 +11,11 @@ def test_ai_simulation():
     # Initialize Validator
     validator = AIValidator()
     
-    # Create dummy image chips
-    chip_start = np.zeros((224, 224, 6))
-    chip_end = np.zeros((224, 224, 6))
+    # Create dummy image chips (uint8, like the Sentinel chips in production).
+    # Non-zero pixels, so verify_change runs the model (blank chips skip it)
+    rng = np.random.default_rng(42)
+    chip_start = rng.integers(0, 255, (224, 224, 6), dtype=np.uint8)
+    chip_end = rng.integers(0, 255, (224, 224, 6), dtype=np.uint8)
     
     # Run Verification
     print("Running verify_change()...")
@@ -1,76 +1,114 @@
-import ee
 import streamlit as st
 import os
-import json
-from google.oauth2 import service_account
+
+# ee dan google-auth diimpor saat dibutuhkan saja (impor awal mahal)
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+GEE_SCOPES = ['https://www.googleapis.com/auth/earthengine']
+
+
+@st.cache_resource(show_spinner=False)
+def _build_credentials(sa_items: tuple):
+    """Membuat kredensial service account (di-cache per isi service account)"""
+    sa_info = dict(sa_items)
+    
+    # Masalah umum di Streamlit: Karakter \n pada private_key sering ter-escape menjadi \\n
+    if 'private_key' in sa_info:
+        sa_info['private_key'] = sa_info['private_key'].replace('\\n', '\n')
+    
+    from google.oauth2 import service_account
+    
+    # Tambahkan scope Earth Engine secara eksplisit agar tidak 'invalid_scope'
+    return service_account.Credentials.from_service_account_info(sa_info, scopes=GEE_SCOPES)
+
 
 def initialize_gee():
     """
     Menginisialisasi Google Earth Engine dengan strategi fallback dan penanganan Streamlit Secrets.
     Sangat penting: Menyertakan scopes Earth Engine secara eksplisit.
+    Hasil sukses di-cache selama proses Streamlit hidup; kegagalan dicoba ulang saat rerun.
     """
-    # Strategi 0: Cek Streamlit Secrets (Paling Utama untuk Cloud Deployment)
+    ok = _initialize_gee()
+    if not ok:
+        _initialize_gee.clear()
+    return ok
+
+
+def _from_secrets():
+    """Strategi 0: Streamlit Secrets (Paling Utama untuk Cloud Deployment)"""
     try:
-        if "gee_service_account" in st.secrets:
-            try:
-                # Ambil info service account dari secrets
-                sa_info = dict(st.secrets["gee_service_account"])
-                
-                # Masalah umum di Streamlit: Karakter \n pada private_key sering ter-escape menjadi \\n
-                if 'private_key' in sa_info:
-                    sa_info['private_key'] = sa_info['private_key'].replace('\\n', '\n')
-                
-                # Tambahkan scope Earth Engine secara eksplisit agar tidak 'invalid_scope'
-                scopes = ['https://www.googleapis.com/auth/earthengine']
-                
-                # Gunakan google-auth untuk membuat kredensial yang valid
-                credentials = service_account.Credentials.from_service_account_info(
-                    sa_info, 
-                    scopes=scopes
-                )
-                
-                # Inisialisasi dengan project_id yang ada di file JSON
-                project_id = sa_info.get("project_id", "ee-streamlit-mataram")
-                
-                ee.Initialize(credentials=credentials, project=project_id)
-                st.success(f"✅ Terhubung via Streamlit Secrets (Project: {project_id})")
-                return True
-                
-            except Exception as e:
+        if "gee_service_account" not in st.secrets:
+            return None
+        # Ambil info service account dari secrets
+        sa_info = dict(st.secrets["gee_service_account"])
+    except Exception:
+        # Bukan di Streamlit Cloud (tidak ada secrets)
+        return None
+    # Inisialisasi dengan project_id yang ada di file JSON
+    return _build_credentials(tuple(sorted(sa_info.items()))), sa_info.get("project_id", "ee-streamlit-mataram")
+
+
+def _from_env():
+    """Strategi 1: Environment variable (untuk deployment manual lainnya)"""
+    raw = os.environ.get('GEE_SERVICE_ACCOUNT')
+    if not raw:
+        return None
+    sa_info = _json.loads(raw)
+    return _build_credentials(tuple(sorted(sa_info.items()))), sa_info.get('project_id')
+
+
+def _from_local():
+    """Strategi 2: Kredensial lokal, misal gcloud auth (untuk development di komputer sendiri)"""
+    # 'persistent' = kredensial tersimpan (default ee.Initialize)
+    return 'persistent', "mataram-sstb"
+
+
+# (resolver, label sukses di UI, berhenti jika gagal)
+# Resolver mengembalikan (credentials, project_id), atau None jika tidak berlaku
+_STRATEGIES = [
+    (_from_secrets, "Streamlit Secrets", True),
+    (_from_env, None, False),
+    (_from_local, None, False),
+]
+
+
+@st.cache_resource(show_spinner=False)
+def _initialize_gee():
+    """Menjalankan strategi inisialisasi GEE berurutan sampai ada yang berhasil"""
+    import ee
+    
+    for resolve, label, stop_on_failure in _STRATEGIES:
+        try:
+            resolved = resolve()
+            if resolved is None:
+                continue
+            credentials, project_id = resolved
+            ee.Initialize(credentials=credentials, project=project_id)
+        except Exception as e:
+            if stop_on_failure:
                 st.error(f"❌ Autentikasi Gagal: {e}")
                 st.code(f"Debug Info: {type(e).__name__}")
                 return False
-    except Exception as e:
-        # Lanjut ke strategi berikutnya jika bukan di Streamlit Cloud
-        pass
-
-    # Strategi 1: Cek environment variables (untuk deployment manual lainnya)
-    if os.environ.get('GEE_SERVICE_ACCOUNT'):
-        try:
-            sa_info = json.loads(os.environ.get('GEE_SERVICE_ACCOUNT'))
-            if 'private_key' in sa_info:
-                sa_info['private_key'] = sa_info['private_key'].replace('\\n', '\n')
-            
-            scopes = ['https://www.googleapis.com/auth/earthengine']
-            credentials = service_account.Credentials.from_service_account_info(sa_info, scopes=scopes)
-            ee.Initialize(credentials=credentials, project=sa_info.get('project_id'))
-            return True
-        except:
-            pass
-
-    # Strategi 2: Cek kredensial lokal (untuk development di komputer sendiri)
-    try:
-        # Mencoba inisialisasi default (misal gcloud auth)
-        ee.Initialize(project="mataram-sstb")
+            continue
+        
+        if label:
+            st.success(f"✅ Terhubung via {label} (Project: {project_id})")
         return True
-    except:
-        return False
+    
+    return False
 
 # Fungsi tambahan (jika diperlukan oleh modul lain)
 def get_gee_status():
-    """Mengecek apakah GEE sudah terinisialisasi"""
+    """Mengecek apakah GEE sudah terinisialisasi (hasil sukses di-cache per sesi)"""
+    if st.session_state.get('gee_ready'):
+        return True
     try:
+        import ee
         ee.Projection('EPSG:4326')
+        st.session_state['gee_ready'] = True
         return True
     except:
         return False